@@ -5,10 +5,16 @@ JSON API definition.
 """
 
 import json
+import base64
 import logging
 import inspect
 import functools
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 
 class Page:
@@ -52,6 +58,11 @@ class Page:
             self.limit = self.page_size
         self.has_next = self.page_index < self.page_count
         self.has_previous = self.page_index > 1
+        self.items = []
+
+    def __json__(self):
+        """ 序列化为JSON时不包含 items，数据行由接口单独返回 """
+        return {k: v for k, v in self.__dict__.items() if k != 'items'}
 
     def __str__(self):
         return 'item_count: %s, page_count: %s, page_index: %s, page_size: %s, offset: %s, limit: %s' % (self.item_count, self.page_count, self.page_index, self.page_size, self.offset, self.limit)
@@ -59,6 +70,53 @@ class Page:
     __repr__ = __str__
 
 
+class CursorPage:
+    """ 基于游标（keyset）的分页，翻页不依赖 offset：Page object for cursor based pagination.
+
+    next/previous 是不透明的游标字符串，分别用于获取下一页和上一页。
+
+    >>> token = CursorPage.encode('next', [1500000000.0, '001'])
+    >>> CursorPage.decode(token)
+    ('next', [1500000000.0, '001'])
+    >>> p = CursorPage(10, next=token)
+    >>> p.has_next, p.has_previous
+    (True, False)
+    """
+    def __init__(self, page_size=10, next=None, previous=None):
+        self.page_size = page_size
+        self.next = next
+        self.previous = previous
+        self.has_next = next is not None
+        self.has_previous = previous is not None
+        self.items = []
+
+    __json__ = Page.__json__
+
+    @staticmethod
+    def encode(direction, values):
+        """ 把翻页方向和排序键的值编码为游标 """
+        s = json.dumps([direction, list(values)], separators=(',', ':'))
+        return base64.urlsafe_b64encode(s.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode(cursor, size=None):
+        """ 解析游标，返回 (direction, values)，size 为排序键的个数 """
+        try:
+            s = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+            direction, values = json.loads(s)
+        except (ValueError, TypeError):
+            raise APIValueError('cursor', 'Invalid cursor.')
+        if direction not in ('next', 'prev') or not isinstance(values, list):
+            raise APIValueError('cursor', 'Invalid cursor.')
+        if (size is not None and len(values) != size) or not all(isinstance(v, (str, int, float)) for v in values):
+            raise APIValueError('cursor', 'Invalid cursor.')
+        return direction, values
+
+    def __str__(self):
+        return 'page_size: %s, next: %s, previous: %s' % (self.page_size, self.next, self.previous)
+
+    __repr__ = __str__
+
 
 class APIError(Exception):
     """ the base APIError which contains error(required), data(optional) and message(optional). """
@@ -85,3 +143,45 @@ class APIPermissionError(APIError):
     """ Indicate the api has no permission. """
     def __init__(self, message=''):
         super(APIPermissionError, self).__init__('permission:forbidden', 'permission', message)
+
+
+# ====================================================================================================
+# API 响应的 JSON 编码：Model 是 dict 的子类，两种编码器都直接序列化；Page 等对象通过 __json__() 输出
+
+def json_default(o):
+    """ JSON序列化：对象可以通过 __json__() 自定义输出，否则使用 __dict__ """
+    if hasattr(o, '__json__'):
+        return o.__json__()
+    if hasattr(o, '__dict__'):
+        return o.__dict__
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def _dumps_json(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=json_default).encode('utf-8')
+
+
+def _dumps_orjson(obj):
+    return orjson.dumps(obj, default=json_default)
+
+
+_ENCODERS = dict(json=_dumps_json)
+if orjson is not None:
+    _ENCODERS['orjson'] = _dumps_orjson
+_encoder = _ENCODERS['orjson' if orjson is not None else 'json']
+
+
+def set_json_encoder(name='auto'):
+    """ 选择 JSON 编码器：'json' 为标准库，'orjson' 需要安装 orjson，'auto' 时有 orjson 就使用 orjson """
+    global _encoder
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in _ENCODERS:
+        raise ValueError(f'JSON encoder not available: {name}')
+    logging.info(f'Use {name} JSON encoder')
+    _encoder = _ENCODERS[name]
+
+
+def dumps(obj):
+    """ 把 API 返回值编码为 UTF-8 的 JSON bytes """
+    return _encoder(obj)
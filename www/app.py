@@ -6,16 +6,23 @@ async web application.
 
 import logging; logging.basicConfig(level=logging.INFO)
 import os
+import sys
 import time
-import json
+import signal
 import asyncio
 from aiohttp import web
 from datetime import datetime
 from jinja2 import Environment, FileSystemLoader
 
 import orm
+import cache
+import assets
+import compress
+import render
+import prefork
 from config import configs
-from coroweb import add_routes, add_static
+from apis import dumps, set_json_encoder
+from coroweb import add_routes, add_static, is_static, needs_user, is_cacheable, make_etag, http_date, not_modified
 from handlers import cookie2user, COOKIE_NAME
 
 
@@ -40,6 +47,7 @@ def init_jinja2(app, **kw):
         variable_start_string=kw.get('variable_start_string', '{{'),
         variable_end_string=kw.get('variable_end_string', '}}'),
         auto_reload=kw.get('auto_reload', True),
+        enable_async=kw.get('stream', False),
     )
     path = kw.get('path', None)
     if path is None:
@@ -50,12 +58,20 @@ def init_jinja2(app, **kw):
     if filters is not None:
         for name, f in filters.items():
             env.filters[name] = f
+    env_globals = kw.get('globals', None)
+    if env_globals is not None:
+        env.globals.update(env_globals)
     app['__templating__'] = env
+    # stream=True 时使用 Jinja2 的异步渲染，边渲染边发送响应
+    app['__templating_stream__'] = kw.get('stream', False)
 
 
 # 以下是middleware,可以把通用的功能从每个URL处理函数中拿出来集中放到一个地方
 async def logger_factory(app, handler):
     """ URL处理日志工厂 """
+    if is_static(handler):
+        return handler
+
     async def logger(request):
         logging.info(f'Request: {request.method} {request.path}')
         # await asyncio.sleep(0.3)
@@ -64,18 +80,116 @@ async def logger_factory(app, handler):
     return logger
 
 
+async def compress_factory(app, handler):
+    """ 响应压缩：按 Accept-Encoding 压缩足够大的文本响应，已压缩过的和流式响应不处理 """
+    if is_static(handler):
+        return handler
+
+    async def compress_response(request):
+        resp = await handler(request)
+        if type(resp) is not web.Response or resp.status not in (200, 304):
+            return resp
+        # 是否压缩取决于 body 大小，304 没有 body 无法判断；为了让 200 和 304 带相同的校验信息，
+        # 无论是否压缩都加上 Vary 并使用弱 ETag（压缩后的内容与原内容字节不同）
+        vary = resp.headers.get('Vary')
+        if vary is None:
+            resp.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            resp.headers['Vary'] = f'{vary}, Accept-Encoding'
+        etag = resp.headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            resp.headers['ETag'] = 'W/' + etag
+        if resp.status != 200 or not isinstance(resp.body, bytes) or 'Content-Encoding' in resp.headers:
+            return resp
+        compressor = app['__compressor__']
+        if not compressor.compressible(resp.content_type, len(resp.body)):
+            return resp
+        encoding = compressor.choose(request)
+        if encoding is None:
+            return resp
+        resp.body = await compressor.compress(resp.body, encoding)
+        resp.headers['Content-Encoding'] = encoding
+        return resp
+    return compress_response
+
+
+async def conditional_factory(app, handler):
+    """ 条件请求：给没有 ETag 的 200 响应按内容生成 ETag，客户端缓存仍有效时返回 304 """
+    if is_static(handler):
+        return handler
+
+    async def conditional(request):
+        resp = await handler(request)
+        if request.method not in ('GET', 'HEAD') or type(resp) is not web.Response or resp.status != 200:
+            return resp
+        if 'ETag' not in resp.headers and isinstance(resp.body, bytes):
+            resp.headers['ETag'] = make_etag(resp.body)
+        if not_modified(request, resp.headers.get('ETag')):
+            return not_modified_response(resp.headers)
+        return resp
+    return conditional
+
+
+def not_modified_response(headers):
+    """ 返回 304，保留校验相关的响应头 """
+    return web.Response(status=304, headers={k: headers[k] for k in ('ETag', 'Last-Modified', 'Cache-Control', 'Vary') if k in headers})
+
+
+async def page_cache_factory(app, handler):
+    """ 整页缓存：没有登录 cookie 的 GET 请求直接返回缓存的 HTML，未命中时缓存渲染结果 """
+    if is_static(handler):
+        return handler
+
+    async def page_cache(request):
+        if request.method != 'GET' or COOKIE_NAME in request.cookies or not cache.pages.ttl or not is_cacheable(request):
+            return (await handler(request))
+        body = await cache.pages.get(request.path, request.query_string)
+        if body is not None:
+            resp = web.Response(body=body)
+            resp.content_type = 'text/html;charset=utf-8'
+            resp.headers['X-Cache'] = 'HIT'
+            return resp
+        request['__page_cache__'] = True
+        resp = await handler(request)
+        if (type(resp) is web.Response and resp.status == 200 and resp.content_type.startswith('text/html')
+                and 'Set-Cookie' not in resp.headers and isinstance(resp.body, bytes)):
+            await cache.pages.set(request.path, request.query_string, resp.body)
+            # 与命中缓存时由 conditional_factory 按内容生成的 ETag 保持一致
+            resp.headers['ETag'] = make_etag(resp.body)
+            resp.headers['X-Cache'] = 'MISS'
+        return resp
+    return page_cache
+
+
+async def orm_factory(app, handler):
+    """ 数据库请求上下文：请求内的对象缓存，以及写过数据库之后本请求内的读操作改走主库 """
+    if is_static(handler):
+        return handler
+
+    async def orm_context(request):
+        orm.begin_request()
+        return (await handler(request))
+    return orm_context
+
+
 async def auth_factory(app, handler):
     """ 认证处理工厂--把当前用户绑定到request上，并对URL/manage/进行拦截 """
+    if is_static(handler):
+        return handler
+
     async def auth(request):
-        logging.info(f'Check user: {request.method} {request.path}')
         request.__user__ = None
+        is_manage = request.path.startswith('/manage/')
+        if not is_manage and not needs_user(request):
+            return (await handler(request))
+        logging.debug(f'Check user: {request.method} {request.path}')
         cookie_str = request.cookies.get(COOKIE_NAME)
         if cookie_str:
             user = await cookie2user(cookie_str)
             if user:
                 logging.info(f'Set current user: {user.email}')
                 request.__user__ = user
-        if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
+        if is_manage and (request.__user__ is None or not request.__user__.admin):
             return web.HTTPFound('/signin')
         return (await handler(request))
     return auth
@@ -83,6 +197,9 @@ async def auth_factory(app, handler):
 
 async def data_factory(app, handler):
     """ 数据处理工厂 """
+    if is_static(handler):
+        return handler
+
     async def parse_data(request):
         if request.method == 'POST':
             if request.content_type.startswith('application/json'):
@@ -97,6 +214,9 @@ async def data_factory(app, handler):
 
 async def response_factory(app, handler):
     """ 响应返回处理工厂 """
+    if is_static(handler):
+        return handler
+
     async def response(request):
         logging.info('Response handler...')
         r = await handler(request)
@@ -114,14 +234,33 @@ async def response_factory(app, handler):
             return resp
         if isinstance(r, dict):
             template = r.get('__template__')
+            # URL处理函数可以返回 __etag__ / __last_modified__，客户端缓存仍有效时不再渲染
+            etag, last_modified = r.pop('__etag__', None), r.pop('__last_modified__', None)
+            if etag is not None and template is not None:
+                # 页面中还包含当前用户、按分钟变化的相对时间（datetime 过滤器）和带哈希的静态文件 URL
+                user_id = request.__user__.id if request.__user__ is not None else None
+                etag = make_etag(etag, user_id, int(time.time() // 60), assets.version())
+            headers = dict()
+            if etag is not None:
+                headers['ETag'] = etag
+            if last_modified is not None:
+                headers['Last-Modified'] = http_date(last_modified)
+            if headers and not_modified(request, etag, last_modified):
+                return not_modified_response(headers)
             if template is None:
                 resp = web.Response(
-                    body=json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'))
+                    body=dumps(r), headers=headers)
                 resp.content_type = 'application/json;charset=utf-8'
                 return resp
             else:
                 r['__user__'] = request.__user__
-                resp = web.Response(body=app['__templating__'].get_template(template).render(**r).encode('utf-8'))
+                # 可能被整页缓存的页面需要完整的 body，不使用流式渲染
+                if app['__templating_stream__'] and not request.get('__page_cache__'):
+                    return await stream_template(request, app['__templating__'].get_template(template), r, headers)
+                env = app['__templating__']
+                # stream=True 时 env 为异步模式，不能在事件循环中调用同步的 render()
+                html = await env.get_template(template).render_async(**r) if env.is_async else env.get_template(template).render(**r)
+                resp = web.Response(body=html.encode('utf-8'), headers=headers)
                 resp.content_type = 'text/html;charset=utf-8'
                 return resp
         if isinstance(r, int) and r >= 100 and r < 600:
@@ -138,6 +277,28 @@ async def response_factory(app, handler):
     return response
 
 
+async def stream_template(request, template, context, headers=None, chunk_size=8192):
+    """ 用 generate_async 渲染模板，累积到 chunk_size 字节就发送一次，首字节更早到达客户端 """
+    resp = web.StreamResponse(headers=headers)
+    resp.content_type = 'text/html'
+    resp.charset = 'utf-8'
+    await resp.prepare(request)
+    buffer = []
+    size = 0
+    async for chunk in template.generate_async(**context):
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            await resp.write(b''.join(buffer))
+            buffer = []
+            size = 0
+    if buffer:
+        await resp.write(b''.join(buffer))
+    await resp.write_eof()
+    return resp
+
+
 def datetime_filter(t):
     """ 时间转换 """
     delta = int(time.time() - t)
@@ -153,27 +314,68 @@ def datetime_filter(t):
     return f'{dt.year}年{dt.month}月{dt.day}日'
 
 
-async def init(loop):
+async def init(loop, sock=None):
+    """ 创建应用并开始监听；sock 为主进程传下来的监听 socket（多进程模式） """
     # await orm.create_pool(loop=loop, host='127.0.0.1', port=3306, user='root', password='root', db='awesome')
+    set_json_encoder(configs.json.encoder)
+    cache.setup(**configs.cache)
+    render.setup(**configs.render)
     await orm.create_pool(loop=loop, **configs.db)
     app = web.Application(
         loop=loop,
         middlewares=[
-            logger_factory, auth_factory, response_factory
+            logger_factory, compress_factory, conditional_factory, page_cache_factory, orm_factory, auth_factory, response_factory
         ]
     )
-    init_jinja2(app, filters=dict(datetime=datetime_filter))
+    app['__compressor__'] = compress.Compressor(**configs.compress)
+    init_jinja2(app, filters=dict(datetime=datetime_filter), globals=dict(static_url=assets.static_url), **configs.template)
     add_routes(app, 'handlers')
-    add_static(app)
+    add_static(app, assets.setup(**configs.static))
 
     runner = web.AppRunner(app)
     await runner.setup()
-    srv = await loop.create_server(runner.server, host='127.0.0.1', port=9000)
-    logging.info('Server started at http://127.0.0.1:9000...')
-    return srv
+    host, port = configs.server.host, configs.server.port
+    if sock is not None:
+        srv = await loop.create_server(runner.server, sock=sock)
+    else:
+        srv = await loop.create_server(runner.server, host=host, port=port, reuse_port=configs.server.reuse_port or None)
+    logging.info(f'Server [{os.getpid()}] started at http://{host}:{port}...')
+    return srv, runner
 
 
-if __name__ == '__main__':
+async def shutdown(srv, runner):
+    """ 优雅退出：停止接受新连接，等待已有请求处理完毕，再关闭数据库连接池 """
+    logging.info(f'Server [{os.getpid()}] shutting down...')
+    srv.close()
+    await srv.wait_closed()
+    await runner.cleanup()
+    await orm.close_pool()
+    render.service.shutdown()
+
+
+def run_server(sock=None):
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(init(loop))
+    srv, runner = loop.run_until_complete(init(loop, sock))
+    prefork.notify_ready()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, loop.stop)
     loop.run_forever()
+    loop.run_until_complete(shutdown(srv, runner))
+
+
+def check_workers(server, cache_config):
+    """ 多进程模式下会话、整页和计数缓存的失效必须对所有子进程可见，进程内缓存只能在单进程时使用 """
+    if server.workers > 1 and cache_config.get('backend', 'memory') == 'memory':
+        raise SystemExit(f"server.workers={server.workers} requires a shared cache: set cache.backend to 'memcached'")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        # 由 prefork.Supervisor 启动的子进程
+        run_server(prefork.inherited_socket())
+    elif configs.server.workers > 1:
+        check_workers(configs.server, configs.cache)
+        prefork.Supervisor([sys.executable, os.path.abspath(__file__), '--worker'], configs.server.workers,
+                           configs.server.host, configs.server.port, configs.server.reuse_port).run()
+    else:
+        run_server()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Static asset pipeline: fingerprint and precompress files under www/static.
+
+启动时（或单独运行 python3 assets.py）把 static 下的每个文件复制为带内容哈希的文件名，
+例如 css/uikit.min.css -> css/uikit.min.3f2a1b4c5d.css，并预先压缩为 .gz 和 .br（需要安装 brotli）。
+结果写入 build 目录，文件内容不变时不会重复压缩。
+
+模板中通过 static_url('css/uikit.min.css') 引用带哈希的 URL，这些 URL 的内容永不改变，
+可以使用一年的 immutable 缓存；原文件名仍然可以访问（例如 CSS 中相对引用的字体），由 ETag 验证缓存。
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from aiohttp import web
+
+from coroweb import not_modified
+from compress import parse_accept_encoding, accepts
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static-build')
+# 值得压缩的文本类文件，图片和 woff 本身已经压缩过
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt', '.otf', '.ttf', '.eot')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprint(name, data):
+    """ 在扩展名前插入内容哈希：css/a.min.css -> css/a.min.<hash>.css """
+    digest = hashlib.sha1(data).hexdigest()[:10]
+    base, ext = os.path.splitext(name)
+    return f'{base}.{digest}{ext}'
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)       # 多个进程同时构建时不会读到写了一半的文件
+
+
+def build(static_dir=STATIC_DIR, build_dir=BUILD_DIR, gzip_level=9, brotli_quality=11):
+    """ 生成带哈希的文件和压缩版本，返回 manifest：原文件名 -> 带哈希的文件名 """
+    manifest = dict()
+    for root, _, files in os.walk(static_dir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            hashed = fingerprint(name, data)
+            manifest[name] = hashed
+            target = os.path.join(build_dir, hashed)
+            if os.path.exists(target):
+                continue
+            logging.info(f'Build static {name} => {hashed}')
+            _write(target, data)
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            _write(target + '.gz', gzip.compress(data, gzip_level))
+            if brotli is not None:
+                _write(target + '.br', brotli.compress(data, quality=brotli_quality))
+    _write(os.path.join(build_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class StaticFiles:
+    """ 从内存中提供 build 生成的静态文件，按 Accept-Encoding 选择 br / gzip / 原文件 """
+
+    def __init__(self, manifest, build_dir=BUILD_DIR):
+        # middleware 遇到时直接返回原处理函数。aiohttp 包装非协程函数的处理函数时只复制实例的 __dict__，
+        # 所以必须设置为实例属性
+        self.__static__ = True
+        self.manifest = manifest
+        self.version = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+        self._files = dict()        # URL 路径 -> (带哈希的文件名, 是否 immutable)
+        self._variants = dict()     # 带哈希的文件名 -> {编码: 内容}
+        for name, hashed in manifest.items():
+            variants = dict()
+            for encoding, suffix in (('identity', ''), ('gzip', '.gz'), ('br', '.br')):
+                path = os.path.join(build_dir, hashed + suffix)
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        variants[encoding] = f.read()
+            self._variants[hashed] = variants
+            self._files[name] = (hashed, False)
+            self._files[hashed] = (hashed, True)
+
+    def url(self, name):
+        """ 模板使用的静态文件 URL，不在 manifest 中的文件返回原路径 """
+        return '/static/' + self.manifest.get(name, name)
+
+    async def __call__(self, request):
+        try:
+            hashed, immutable = self._files[request.match_info['path']]
+        except KeyError:
+            raise web.HTTPNotFound()
+        etag = f'"{hashed}"'
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': IMMUTABLE if immutable else 'no-cache'}
+        if not_modified(request, etag):
+            return web.Response(status=304, headers=headers)
+        variants = self._variants[hashed]
+        # 选择客户端 q 值最高的预压缩版本，q 值相同时优先 br，都不接受时返回原文件
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+        encoding, best_q = 'identity', 0.0
+        for e in ('br', 'gzip'):
+            if e in variants and accepts(accepted, e) > best_q:
+                encoding, best_q = e, accepts(accepted, e)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        content_type = mimetypes.guess_type(hashed)[0] or 'application/octet-stream'
+        return web.Response(body=variants[encoding], content_type=content_type, headers=headers)
+
+
+_static = None
+
+
+def setup(static_dir=STATIC_DIR, build_dir=BUILD_DIR, **kw):
+    """ 构建并加载静态文件，返回 URL 处理函数 """
+    global _static
+    _static = StaticFiles(build(static_dir, build_dir, **kw), build_dir)
+    logging.info(f'Loaded {len(_static.manifest)} static files, brotli {"enabled" if brotli else "not installed"}')
+    return _static
+
+
+def version():
+    """ 静态文件的版本号，任何文件变化后都会改变，页面的 ETag 需要包含它 """
+    return None if _static is None else _static.version
+
+
+def static_url(name):
+    """ Jinja2 全局函数：{{ static_url('css/uikit.min.css') }} """
+    if _static is None:
+        return '/static/' + name
+    return _static.url(name)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(f'Built {len(build())} static files into {BUILD_DIR}')
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+One-shot backfill of derived columns (e.g. html_content) and indexes (__indexes__) for existing tables.
+
+Usage: python3 backfill.py
+"""
+
+import logging; logging.basicConfig(level=logging.INFO)
+import asyncio
+
+import orm
+from config import configs
+from models import User, Blog, Comment
+
+BATCH_SIZE = 100
+
+
+async def add_missing_columns(model):
+    """ 为旧表补上派生列 """
+    for key in model.__derived__:
+        field = model.__mappings__[key]
+        column = field.name or key
+        num = await orm.select(
+            'select count(*) _num_ from information_schema.columns where table_schema=database() and table_name=? and column_name=?',
+            [model.__table__, column], 1)
+        if num[0]['_num_'] == 0:
+            logging.info(f'Add column {model.__table__}.{column}')
+            await orm.execute(f'alter table `{model.__table__}` add column `{column}` {field.column_type}', None)
+
+
+async def add_missing_indexes(model):
+    """ 为旧表补上 __indexes__ 中的索引，create table if not exists 不会修改已存在的表 """
+    for idx in getattr(model, '__indexes__', ()):
+        name = 'idx_%s' % '_'.join(idx)
+        num = await orm.select(
+            'select count(*) _num_ from information_schema.statistics where table_schema=database() and table_name=? and index_name=?',
+            [model.__table__, name], 1)
+        if num[0]['_num_'] == 0:
+            logging.info(f'Add index {model.__table__}.{name}')
+            columns = ', '.join(f'`{c}`' for c in idx)
+            await orm.execute(f'alter table `{model.__table__}` add index `{name}` ({columns})', None)
+
+
+async def backfill(model):
+    """ 分批计算并写回派生列为空的行 """
+    where = ' or '.join(f'`{model.__mappings__[k].name or k}` is null' for k in model.__derived__)
+    total = 0
+    while True:
+        rows = await model.findAll(where, orderBy=f'`{model.__primary_key__}`', limit=BATCH_SIZE, columns=list(model.__mappings__))
+        for r in rows:
+            await r.update()
+        total += len(rows)
+        if len(rows) < BATCH_SIZE:
+            break
+    logging.info(f'Backfilled {total} rows of {model.__table__}')
+
+
+async def main(loop):
+    await orm.create_pool(loop=loop, **configs.db)
+    for model in (User, Blog, Comment):
+        await add_missing_indexes(model)
+    for model in (Blog, Comment):
+        await add_missing_columns(model)
+        await backfill(model)
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop))
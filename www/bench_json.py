@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark JSON encoding of api_blogs / api_comments payloads.
+
+比较原来的 json.dumps(r, default=lambda o: o.__dict__) 与 apis.dumps 的标准库和 orjson 编码器。
+
+Usage: python3 bench_json.py [page_size]
+"""
+
+import sys
+import json
+import time
+import timeit
+
+import apis
+from apis import Page
+from models import Blog, Comment, next_id
+
+
+def blogs_payload(n):
+    """ 与 api_blogs 相同结构的返回值，列表查询不包含延迟加载的 content / html_content """
+    blogs = [Blog.fromRow(dict(
+        id=next_id(), user_id=next_id(), user_name='管理员', user_image='http://www.gravatar.com/avatar/0?d=mm&s=120',
+        name=f'日志标题 {i}', summary='这是一段日志摘要，' * 5, created_at=time.time() - i * 3600)) for i in range(n)]
+    page = Page(1000, 1, n)
+    page.items = blogs
+    return dict(page=page, blogs=blogs)
+
+
+def comments_payload(n):
+    """ 与 api_comments 相同结构的返回值 """
+    comments = [Comment.fromRow(dict(
+        id=next_id(), blog_id=next_id(), user_id=next_id(), user_name=f'用户{i}',
+        user_image='http://www.gravatar.com/avatar/0?d=mm&s=120', content='评论内容 <b>HTML</b> & "引号"\n' * 3,
+        html_content='<p>评论内容 &lt;b&gt;HTML&lt;/b&gt; &amp; &quot;引号&quot;</p>' * 3,
+        created_at=time.time() - i * 60)) for i in range(n)]
+    page = Page(1000, 1, n)
+    page.items = comments
+    return dict(page=page, comments=comments)
+
+
+def legacy(r):
+    return json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8')
+
+
+def bench(name, payload, number=2000):
+    encoders = [('legacy', legacy)] + [(k, v) for k, v in sorted(apis._ENCODERS.items())]
+    base = None
+    for label, fn in encoders:
+        seconds = min(timeit.repeat(lambda: fn(payload), number=number, repeat=3)) / number
+        base = base or seconds
+        print(f'{name:<14}{label:<10}{seconds * 1e6:>10.1f} us{base / seconds:>8.2f}x{len(fn(payload)):>10} bytes')
+
+
+if __name__ == '__main__':
+    page_size = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    bench('api_blogs', blogs_payload(page_size))
+    bench('api_comments', comments_payload(page_size))
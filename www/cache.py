@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Caches: in-process LRU and pluggable shared cache backends.
+"""
+
+import math
+import time
+import pickle
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ 按最近最少使用淘汰的缓存，同时限制条目数和总字节数：LRU cache bounded by item count and byte size.
+
+    ttl 不为 None 时条目在 ttl 秒后过期，set() 也可以为单个条目指定 ttl。
+    """
+
+    def __init__(self, max_items=1024, max_bytes=16 * 1024 * 1024, sizeof=len, ttl=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def get(self, key, default=None):
+        try:
+            value, size, expires = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.time() + ttl
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            logging.info(f'Value too large to cache: {size} bytes')
+            self.delete(key)
+            return
+        if key in self._data:
+            self._bytes -= self._data.pop(key)[1]
+        self._data[key] = (value, size, expires)
+        self._bytes += size
+        # 从最久未使用的一端开始淘汰
+        while len(self._data) > self.max_items or self._bytes > self.max_bytes:
+            _, (_, evicted, _) = self._data.popitem(last=False)
+            self._bytes -= evicted
+
+    def replace(self, key, value):
+        """ 修改已有条目的值，保留原来的过期时间，条目不存在或已过期时返回 False """
+        if self.get(key) is None:
+            return False
+        expires = self._data[key][2]
+        self.set(key, value, None if expires is None else expires - time.time())
+        return True
+
+    def delete(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+            return True
+        return False
+
+    def items(self):
+        """ 返回所有未过期的 (key, value)，不影响淘汰顺序 """
+        now = time.time()
+        return [(k, v) for k, (v, _, expires) in self._data.items() if expires is None or expires >= now]
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+
+# ====================================================================================================
+# 可在多个进程间共享的缓存后端，所有操作都是协程
+
+class CacheBackend:
+    """ 缓存后端的基类：get/set/delete/incr，以及带请求合并的 get_or_set。 """
+
+    def __init__(self):
+        self._inflight = dict()     # key -> 正在计算该 key 的 Future，用于合并并发的相同请求
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def incr(self, key, delta=1, initial=None, ttl=None):
+        """ 原子加减计数，key 不存在时如果给出了 initial 则设置为 initial，否则返回 None """
+        raise NotImplementedError
+
+    async def get_or_set(self, key, factory, ttl=None):
+        """ 缓存未命中时调用 factory() 计算并写入缓存。
+
+        同一进程内对同一 key 的并发未命中只会调用一次 factory()，其余请求等待其结果，避免缓存击穿。
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_event_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await factory()
+            if value is not None:
+                await self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()      # 没有等待者时避免 'exception was never retrieved' 警告
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+
+def _sizeof(value):
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return len(value) if isinstance(value, bytes) else 1
+
+
+class MemoryCache(CacheBackend):
+    """ 进程内的 LRU 缓存后端 """
+
+    def __init__(self, max_items=10000, max_bytes=64 * 1024 * 1024, **kw):
+        super().__init__()
+        self._lru = LRUCache(max_items=max_items, max_bytes=max_bytes, sizeof=_sizeof)
+
+    async def get(self, key):
+        return self._lru.get(key)
+
+    async def set(self, key, value, ttl=None):
+        self._lru.set(key, value, ttl)
+
+    async def delete(self, key):
+        self._lru.delete(key)
+
+    async def incr(self, key, delta=1, initial=None, ttl=None):
+        value = self._lru.get(key)
+        if value is None:
+            if initial is None:
+                return None
+            self._lru.set(key, initial, ttl)
+            return initial
+        value = max(0, value + delta)
+        self._lru.replace(key, value)
+        return value
+
+
+class MemcachedCache(CacheBackend):
+    """ 基于 memcached 文本协议的网络缓存后端，供多个进程共享。
+
+    任何网络错误都只记录日志并当作未命中处理，缓存不可用时不影响正常请求。
+    """
+
+    _PICKLE, _BYTES, _INT = 0, 1, 2
+
+    def __init__(self, host='127.0.0.1', port=11211, prefix='awesome:', pool_size=4, timeout=1.0, **kw):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.timeout = timeout
+        self._pool_size = pool_size
+        self._idle = []
+        self._semaphore = None
+
+    def _key(self, key):
+        data = (self.prefix + key).encode('utf-8')
+        # memcached 的 key 不能超过 250 字节，且不能包含空白和控制字符；非 ASCII 字符按 UTF-8 字节数计算
+        if len(data) > 250 or any(c <= 32 or c == 127 for c in data):
+            data = (self.prefix + hashlib.sha1(data).hexdigest()).encode('utf-8')
+        return data
+
+    @classmethod
+    def _dumps(cls, value):
+        if isinstance(value, bool):
+            return cls._PICKLE, pickle.dumps(value)
+        if isinstance(value, int):
+            return cls._INT, str(value).encode('ascii')
+        if isinstance(value, bytes):
+            return cls._BYTES, value
+        return cls._PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def _loads(cls, flags, data):
+        if flags == cls._INT:
+            return int(data)
+        if flags == cls._BYTES:
+            return data
+        return pickle.loads(data)
+
+    async def _call(self, command, reader_fn):
+        """ 取一个连接发送命令，并用 reader_fn(reader) 读取响应 """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._pool_size)
+        async with self._semaphore:
+            conn = self._idle.pop() if self._idle else None
+            try:
+                if conn is None:
+                    conn = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                reader, writer = conn
+                writer.write(command)
+                result = await asyncio.wait_for(reader_fn(reader), self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                logging.warning(f'Memcached {self.host}:{self.port} error: {e!r}')
+                if conn is not None:
+                    conn[1].close()
+                return None
+            self._idle.append(conn)
+            return result
+
+    async def get(self, key):
+        async def read(reader):
+            line = await reader.readline()
+            if line == b'END\r\n':
+                return None
+            _, _, flags, size = line.split()
+            data = await reader.readexactly(int(size) + 2)
+            await reader.readline()     # END
+            return self._loads(int(flags), data[:-2])
+        return await self._call(b'get ' + self._key(key) + b'\r\n', read)
+
+    async def _store(self, command, key, value, ttl):
+        flags, data = self._dumps(value)
+        exptime = 0 if ttl is None else max(1, math.ceil(ttl))
+        header = b'%s %s %d %d %d\r\n' % (command, self._key(key), flags, exptime, len(data))
+
+        async def read(reader):
+            return (await reader.readline()) == b'STORED\r\n'
+        return await self._call(header + data + b'\r\n', read)
+
+    async def set(self, key, value, ttl=None):
+        return await self._store(b'set', key, value, ttl)
+
+    async def delete(self, key):
+        async def read(reader):
+            return (await reader.readline()) == b'DELETED\r\n'
+        return await self._call(b'delete ' + self._key(key) + b'\r\n', read)
+
+    async def incr(self, key, delta=1, initial=None, ttl=None):
+        command = b'incr' if delta >= 0 else b'decr'
+
+        async def read(reader):
+            line = await reader.readline()
+            return None if line.startswith(b'NOT_FOUND') else int(line)
+        value = await self._call(b'%s %s %d\r\n' % (command, self._key(key), abs(delta)), read)
+        if value is None and initial is not None:
+            # 不存在时用 add 初始化，与其他进程并发初始化时以先写入者为准
+            if not await self._store(b'add', key, initial, ttl):
+                return await self.incr(key, delta, None, ttl)
+            value = initial
+        return value
+
+
+_BACKENDS = dict(memory=MemoryCache, memcached=MemcachedCache)
+_default = MemoryCache()
+
+
+class PageCache:
+    """ 匿名访问的整页缓存，按 path 和 query 保存渲染好的 HTML。
+
+    key 中带有全站和单个 path 的版本号，失效时只需增加版本号，旧条目不再被读到，由 ttl 或 LRU 淘汰。
+    版本号的初始值取当前毫秒时间，缓存被清空后重新生成的版本号不会与旧版本重复。
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+
+    async def _key(self, path, query):
+        backend = get_cache()
+        site = await backend.get('page-gen') or 0
+        page = await backend.get(f'page-gen:{path}') or 0
+        return f'page:{site}:{page}:{path}?{query}'
+
+    async def get(self, path, query=''):
+        if not self.ttl:
+            return None
+        return await get_cache().get(await self._key(path, query))
+
+    async def set(self, path, query, body):
+        if self.ttl:
+            await get_cache().set(await self._key(path, query), body, self.ttl)
+
+    async def invalidate(self, path=None):
+        """ 使 path 下的所有页面失效，path 为 None 时使全站页面失效 """
+        key = 'page-gen' if path is None else f'page-gen:{path}'
+        await get_cache().incr(key, 1, initial=int(time.time() * 1000))
+
+
+pages = PageCache()
+
+
+def setup(backend='memory', page_ttl=60, **kw):
+    """ 按配置创建默认的共享缓存后端，page_ttl 为整页缓存的秒数，0 表示不缓存页面 """
+    global _default
+    if backend not in _BACKENDS:
+        raise ValueError(f'Unknown cache backend: {backend}')
+    logging.info(f'Use {backend} cache backend')
+    _default = _BACKENDS[backend](**kw)
+    pages.ttl = page_ttl
+    return _default
+
+
+def get_cache():
+    """ 返回默认的共享缓存后端 """
+    return _default
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-the-fly response compression: gzip, and brotli / zstd when installed.
+"""
+
+import gzip
+import asyncio
+import logging
+import functools
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _gzip(data, level):
+    return gzip.compress(data, level, mtime=0)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+CODECS = dict(gzip=_gzip)
+if brotli is not None:
+    CODECS['br'] = _brotli
+if zstandard is not None:
+    CODECS['zstd'] = _zstd
+
+LEVELS = dict(gzip=6, br=4, zstd=3)
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+def parse_accept_encoding(header):
+    """ 解析 Accept-Encoding，返回 {编码: q}，包括 q=0 明确拒绝的编码
+
+    >>> sorted(parse_accept_encoding('gzip, deflate;q=0.5, br;q=0').items())
+    [('br', 0.0), ('deflate', 0.5), ('gzip', 1.0)]
+    """
+    accepted = dict()
+    for item in header.lower().split(','):
+        encoding, _, params = item.partition(';')
+        encoding = encoding.strip()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if encoding:
+            accepted[encoding] = q
+    return accepted
+
+
+def accepts(accepted, encoding):
+    """ 客户端对 encoding 的 q 值，* 只适用于没有单独列出的编码
+
+    >>> accepted = parse_accept_encoding('gzip;q=0, *')
+    >>> accepts(accepted, 'gzip'), accepts(accepted, 'br')
+    (0.0, 1.0)
+    """
+    return accepted.get(encoding, accepted.get('*', 0.0))
+
+
+class Compressor:
+    """ 按服务端偏好的顺序选择客户端接受的编码，小于 min_size 的响应不压缩，
+        大于 thread_above 的 body 在线程池中压缩，避免阻塞事件循环
+    """
+
+    def __init__(self, encodings=('br', 'zstd', 'gzip'), min_size=1024, levels=None, thread_above=64 * 1024):
+        missing = [e for e in encodings if e not in CODECS]
+        if missing:
+            logging.info(f'Compression not available: {", ".join(missing)}')
+        self.encodings = [e for e in encodings if e in CODECS]
+        self.min_size = min_size
+        self.levels = dict(LEVELS, **(levels or dict()))
+        self.thread_above = thread_above
+
+    def compressible(self, content_type, size):
+        return size >= self.min_size and content_type.startswith(COMPRESSIBLE)
+
+    def choose(self, request):
+        """ 返回客户端 q 值最高的编码，q 值相同时按服务端的偏好顺序，都不接受时返回 None """
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = accepts(accepted, encoding)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    async def compress(self, data, encoding):
+        fn = functools.partial(CODECS[encoding], data, self.levels[encoding])
+        if len(data) < self.thread_above:
+            return fn()
+        return await asyncio.get_event_loop().run_in_executor(None, fn)
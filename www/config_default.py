@@ -6,14 +6,62 @@ Default configurations.
 
 configs = {
     'debug': True,
+    # workers 大于 1 时以多进程模式运行（要求 cache.backend 为 'memcached'），reuse_port=True 时每个子进程通过 SO_REUSEPORT 各自绑定端口
+    'server': {
+        'host': '127.0.0.1',
+        'port': 9000,
+        'workers': 1,
+        'reuse_port': False
+    },
     'db': {
         'host': '127.0.0.1',
         'port': 3306,
         'user': 'root',
         'password': 'root',
-        'db': 'awesome'
+        'db': 'awesome',
+        # 连接池大小，等待连接超过 slow_acquire 秒时记录警告
+        'minsize': 1,
+        'maxsize': 10,
+        'slow_acquire': 0.1,
+        # 只读从库，例如 [{'host': '10.0.0.2'}]，未给出的参数沿用主库配置
+        'replicas': [],
+        'replica_strategy': 'round_robin'
     },
     'session': {
         'secret': 'Awesome'
+    },
+    # Markdown 渲染进程池：workers 为 0 时在事件循环中直接渲染
+    'render': {
+        'workers': 2,
+        'max_pending': 32,
+        'timeout': 5.0,
+        'inline_below': 4096
+    },
+    # stream=True 时模板使用 Jinja2 异步渲染并以 StreamResponse 分块发送
+    'template': {
+        'stream': False
+    },
+    # 静态文件：启动时生成带哈希的文件名和 gzip / brotli 压缩版本，brotli 需要安装 brotli 包
+    'static': {
+        'gzip_level': 9,
+        'brotli_quality': 11
+    },
+    # 响应压缩：按顺序选择客户端接受的编码（br、zstd 需要安装 brotli、zstandard 包），
+    # 小于 min_size 字节的响应不压缩，大于 thread_above 字节的响应在线程池中压缩
+    'compress': {
+        'encodings': ['br', 'zstd', 'gzip'],
+        'min_size': 1024,
+        'levels': {'gzip': 6, 'br': 4, 'zstd': 3},
+        'thread_above': 65536
+    },
+    # API 响应的 JSON 编码器：'auto' 时安装了 orjson 就使用 orjson，否则使用标准库 json
+    'json': {
+        'encoder': 'auto'
+    },
+    # 共享缓存：'memory' 为进程内缓存；多进程部署时使用 'memcached'，并给出 host、port
+    # page_ttl 为匿名访问整页缓存的秒数，0 表示关闭
+    'cache': {
+        'backend': 'memory',
+        'page_ttl': 60
     }
 }
@@ -3,39 +3,104 @@
 
 import asyncio
 import functools
+import hashlib
 import inspect
 import logging
 import os
+from email.utils import formatdate, parsedate_to_datetime
 from urllib import parse
 from aiohttp import web
 from apis import APIError
 # apis是处理分页的模块，APIError 是指API调用时发生逻辑错误
 
 
-def get(path):
-    """ Define decorator @get('/path') """
+def get(path, *, auth=True, cache=False):
+    """ Define decorator @get('/path')，auth=False 表示该URL不需要当前用户，跳过 cookie 验证；
+        cache=True 表示匿名访问时可以缓存整个页面
+    """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kw):
             return func(*args, **kw)
         wrapper.__method__ = 'GET'
         wrapper.__route__ = path
+        wrapper.__auth__ = auth
+        wrapper.__cache__ = cache
         return wrapper
     return decorator
 
 
-def post(path):
-    """ Define decorator @post('/path') """
+def post(path, *, auth=True, cache=False):
+    """ Define decorator @post('/path')，auth=False 表示该URL不需要当前用户，跳过 cookie 验证；
+        cache=True 表示匿名访问时可以缓存整个页面
+    """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kw):
             return func(*args, **kw)
         wrapper.__method__ = 'POST'
         wrapper.__route__ = path
+        wrapper.__auth__ = auth
+        wrapper.__cache__ = cache
         return wrapper
     return decorator
 
 
+def is_static(handler):
+    """ 是否是 add_static 注册的静态文件处理函数，middleware 遇到时直接返回原处理函数 """
+    handler = getattr(handler, '__wrapped__', handler)
+    return getattr(handler, '__static__', False) or isinstance(getattr(handler, '__self__', None), web.StaticResource)
+
+
+def needs_user(request):
+    """ 当前请求匹配到的URL处理函数是否需要当前用户 """
+    return getattr(request.match_info.handler, 'auth', True)
+
+
+def is_cacheable(request):
+    """ 当前请求匹配到的URL处理函数是否允许缓存匿名访问的页面 """
+    return getattr(request.match_info.handler, 'cache', False)
+
+
+def make_etag(*parts):
+    """ 由若干值生成强 ETag，所有值不变时 ETag 不变 """
+    sha1 = hashlib.sha1()
+    for part in parts:
+        sha1.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        sha1.update(b'\0')
+    return f'"{sha1.hexdigest()}"'
+
+
+def http_date(t):
+    """ 时间戳转换为 Last-Modified 使用的 HTTP 日期格式 """
+    return formatdate(t, usegmt=True)
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """ 根据 If-None-Match / If-Modified-Since 判断客户端缓存是否仍然有效，last_modified 为时间戳。
+        同时带有两个请求头时只比较 If-None-Match
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        # 弱比较：忽略 W/ 前缀
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return etag.replace('W/', '', 1) in [t.replace('W/', '', 1) for t in tags]
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
 def get_required_kw_args(fn):
     args = []
     params = inspect.signature(fn).parameters
@@ -94,6 +159,8 @@ class RequestHandler:
         self._has_named_kw_args = has_named_kw_args(fn)
         self._named_kw_args = get_named_kw_args(fn)
         self._required_kw_args = get_required_kw_args(fn)
+        self.auth = getattr(fn, '__auth__', True)
+        self.cache = getattr(fn, '__cache__', False)
 
 
     async def __call__(self, request):
@@ -150,8 +217,12 @@ class RequestHandler:
             return dict(error=e.error, data=e.data, message=e.message)
 
 
-def add_static(app):
-    """ 用来注册static文件夹下的文件 """
+def add_static(app, files=None):
+    """ 用来注册static文件夹下的文件，files 为 assets.StaticFiles 时由它提供带哈希和预压缩的文件 """
+    if files is not None:
+        app.router.add_get('/static/{path:.*}', files)
+        logging.info(f"Add static {'/static/'} => {len(files.manifest)} built files")
+        return
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
     app.router.add_static('/static/', path)
     logging.info(f"Add static {'/static/'} => {path}")
@@ -6,25 +6,27 @@ url handlers
 
 import re
 import time
-import json
 import logging
 import hashlib
 import base64
 import asyncio
 from aiohttp import web
 
-from markdown2 import markdown
-
 from config import configs
-from coroweb import get, post
+from coroweb import get, post, make_etag
+from orm import transaction, pool_stats
 from models import User, Comment, Blog, next_id
-from apis import Page, APIValueError, APIResourceNotFoundError, APIPermissionError, APIError
+from apis import APIValueError, APIResourceNotFoundError, APIPermissionError, APIError, dumps
+from render import render_markdown, invalidate_markdown, text2html
+from cache import get_cache, pages
 
 
 COOKIE_NAME = 'awesession'
 _COOKIE_KEY = configs.session.secret
 _RE_EMAIL = re.compile(r'^[a-z0-9\.\-\_]+\@[a-z0-9\-\_]+(\.[a-z0-9\-\_]+){1,4}$')
 _RE_SHA1 = re.compile(r'^[0-9a-f]{40}$')
+# 已验证的 cookie 在共享缓存中保存用户数据（密码已屏蔽）的秒数，命中时不再查询数据库和计算 SHA1
+_SESSION_TTL = 300
 
 
 def check_admin(request):
@@ -45,12 +47,6 @@ def get_page_index(page_str):
     return p
 
 
-def text2html(text):
-    """ 文本转HTML """
-    lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', text.split('\n')))
-    return ''.join(lines)
-
-
 def user2cookie(user, max_page):
     """ 计算加密cookie：Generate cookie str by user."""
     # build cookie string by: id-expires-sha1
@@ -71,6 +67,10 @@ async def cookie2user(cookie_str: str):
         uid, expires, sha1 = lst
         if int(expires) < time.time():
             return None
+        key = await _session_key(cookie_str)
+        cached = await get_cache().get(key)
+        if cached is not None:
+            return User.fromRow(cached)
         user = await User.find(uid)
         if user is None:
             return None
@@ -79,12 +79,29 @@ async def cookie2user(cookie_str: str):
             logging.info('Invalid sha1.')
             return None
         user.passwd = '*' * 6
+        await get_cache().set(key, dict(user), min(_SESSION_TTL, int(expires) - time.time()))
         return user
     except Exception as e:
         logging.exception(e)
         return None
 
 
+async def _session_key(cookie_str):
+    """ 会话的缓存键，包含用户的会话版本号，版本号增加后该用户的所有会话缓存失效 """
+    uid = cookie_str.split('-', 1)[0]
+    generation = await get_cache().get(f'session-gen:{uid}') or 0
+    return f'session:{generation}:{cookie_str}'
+
+
+async def invalidate_sessions(cookie_str=None, uid=None):
+    """ 使缓存的会话失效：按 cookie（注销），或按用户（修改密码、删除用户） """
+    if cookie_str:
+        await get_cache().delete(await _session_key(cookie_str))
+    if uid:
+        # 版本号比会话缓存活得久，过期后旧版本的会话缓存也已经过期
+        await get_cache().incr(f'session-gen:{uid}', 1, initial=1, ttl=_SESSION_TTL)
+
+
 # @get('/')
 # async def index(request):
 #     """ 处理首页URL """
@@ -104,33 +121,37 @@ async def cookie2user(cookie_str: str):
 #         'blogs': blogs,
 #         # '__user__': request.__user__
 #     }
-@get('/')
-async def index(*, page='1'):
+@get('/', cache=True)
+async def index(*, page=None, cursor=None):
     """ 处理首页URL """
-    page_index = get_page_index(page)
-    num = await Blog.findNumber('count(id)')
-    page = Page(num, page_index)
-    if num == 0:
-        blogs = []
+    if page is None:
+        page = await Blog.findCursor(cursor)
     else:
-        blogs = await Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit))
+        page = await Blog.findPage(get_page_index(page))
     return {
         '__template__': 'blogs.html',
+        '__etag__': make_etag(page.__json__(), *((b.id, b.name, b.summary) for b in page.items)),
         'page': page,
-        'blogs': blogs
+        'blogs': page.items
     }
 
 
-@get('/blog/{id}')
+@get('/blog/{id}', cache=True)
 async def get_blog(id):
     """ 处理日志详情页面URL """
     blog = await Blog.find(id)
     comments = await Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
+    # 日志没有修改时间，ETag 由页面用到的内容生成
+    etag = make_etag(blog.id, blog.name, blog.summary, blog.content, *((c.id, c.user_name) for c in comments))
+    # html_content 在保存时已生成，仅对尚未回填的旧数据现场渲染
     for c in comments:
-        c.html_content = text2html(c.content)
-    blog.html_content = markdown(blog.content)
+        if c.html_content is None:
+            c.html_content = text2html(c.content)
+    if blog.html_content is None:
+        blog.html_content = await render_markdown(blog.content)
     return {
         '__template__': 'blog.html',
+        '__etag__': etag,
         'blog': blog,
         'comments': comments
     }
@@ -205,17 +226,18 @@ def signin():
     }
 
 
-@get('/signout')
-def signout(request):
+@get('/signout', auth=False)
+async def signout(request):
     """ 用户注销 """
     referer = request.headers.get('Referer')
     r = web.HTTPFound(referer or '/')
+    await invalidate_sessions(cookie_str=request.cookies.get(COOKIE_NAME))
     r.set_cookie(COOKIE_NAME, '-deleted-', max_age=0, httponly=True)
     logging.info('User signed out.')
     return r
 
 
-@post('/api/authenticate')
+@post('/api/authenticate', auth=False)
 async def authenticate(*, email, passwd):
     """ 用户登录验证 """
     if not email:
@@ -237,12 +259,12 @@ async def authenticate(*, email, passwd):
     r = web.Response()
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
     user.passwd = '*' * 6
-    r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.content_type = 'application/json;charset=utf-8'
+    r.body = dumps(user)
     return r
 
 
-@post('/api/users')
+@post('/api/users', auth=False)
 async def api_register_user(*, email, name, passwd):
     """ 用户注册API """
     if not name or not name.strip():
@@ -263,63 +285,61 @@ async def api_register_user(*, email, name, passwd):
     r = web.Response()
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
     user.passwd = '*' * 6
-    r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.content_type = 'application/json;charset=utf-8'
+    r.body = dumps(user)
     return r
 
 
-@get('/api/users')
-async def api_get_users(*, page='1'):
+@get('/api/metrics')
+async def api_metrics(request):
+    """ 获取连接池和查询耗时统计API """
+    check_admin(request)
+    return pool_stats()
+
+
+@get('/api/users', auth=False)
+async def api_get_users(*, page='1', cursor=None):
     """ 获取用户信息API """
     # users = await User.findAll(orderBy='created_at desc')
     # for u in users:
     #     u.passwd = '*' * 6
     # return dict(users=users)
-    page_index = get_page_index(page)
-    num = await User.findNumber('count(id)')
-    p = Page(num, page_index)
-    if num == 0:
-        return dict(page=p, users=())
-    users = await User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
-    for u in users:
+    if cursor is not None:
+        p = await User.findCursor(cursor)
+    else:
+        p = await User.findPage(get_page_index(page))
+    for u in p.items:
         u.passwd = '*' * 6
-    return dict(page=p, users=users)
+    return dict(page=p, users=p.items)
 
 
 @post('/api/users/{id}/delete')
 async def api_delete_users(id, request):
     """ 删除用户API """
     check_admin(request)
-    id_buff = id
     user = await User.find(id)
     if user is None:
         raise APIResourceNotFoundError('Comment')
-    await user.remove()
-    # 给被删除的用户在评论中标记
-    comments = await Comment.findAll('user_id=?',[id])
-    if comments:
-        for comment in comments:
-            id = comment.id
-            c = await Comment.find(id)
-            c.user_name = c.user_name + ' (该用户已被删除)'
-            await c.update()
-    id = id_buff
+    async with transaction():
+        await user.remove()
+        # 给被删除的用户在评论中标记
+        await Comment.updateWhere("`user_name`=concat(`user_name`, ?)", 'user_id=?', [' (该用户已被删除)', id])
+    await invalidate_sessions(uid=id)
+    await pages.invalidate()
     return dict(id=id)
 
 
-@get('/api/blogs')
-async def api_blogs(*, page='1'):
+@get('/api/blogs', auth=False)
+async def api_blogs(*, page='1', cursor=None):
     """ 获取日志列表API """
-    page_index = get_page_index(page)
-    num = await Blog.findNumber('count(id)')
-    p = Page(num, page_index)
-    if num == 0:
-        return dict(page=p, blogs=())
-    blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
-    return dict(page=p, blogs=blogs)
+    if cursor is not None:
+        p = await Blog.findCursor(cursor)
+    else:
+        p = await Blog.findPage(get_page_index(page))
+    return dict(page=p, blogs=p.items)
 
 
-@get('/api/blogs/{id}')
+@get('/api/blogs/{id}', auth=False)
 async def api_get_blog(*, id):
     """ 获取日志详情API """
     blog = await Blog.find(id)
@@ -338,6 +358,7 @@ async def api_create_blog(request, *, name, summary, content):
         raise APIValueError('content', 'Content cannot be empty.')
     blog = Blog(user_id=request.__user__.id, user_name=request.__user__.name, user_image=request.__user__.image, name=name.strip(), summary=summary.strip(), content=content.strip())
     await blog.save()
+    await pages.invalidate()
     return blog
 
 
@@ -352,10 +373,12 @@ async def api_update_blog(id, request, *, name, summary, content):
         raise APIValueError('summary', 'Summary cannot be empty.')
     if not content or not content.strip():
         raise APIValueError('content', 'Content cannot be empty.')
+    invalidate_markdown(blog.content)
     blog.name = name.strip()
     blog.summary = summary.strip()
     blog.content = content.strip()
     await blog.update()
+    await pages.invalidate()
     return blog
 
 
@@ -365,19 +388,19 @@ async def api_delete_blog(request, *, id):
     check_admin(request)
     blog = await Blog.find(id)
     await blog.remove()
+    invalidate_markdown(blog.content)
+    await pages.invalidate()
     return dict(id=id)
 
 
-@get('/api/comments')
-async def api_comments(*, page='1'):
+@get('/api/comments', auth=False)
+async def api_comments(*, page='1', cursor=None):
     """ 获取评论信息API """
-    page_index = get_page_index(page)
-    num = await Comment.findNumber('count(id)')
-    p = Page(num, page_index)
-    if num == 0:
-        return dict(page=p, comments=())
-    comments = await Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
-    return dict(page=p, comments=comments)
+    if cursor is not None:
+        p = await Comment.findCursor(cursor)
+    else:
+        p = await Comment.findPage(get_page_index(page))
+    return dict(page=p, comments=p.items)
 
 
 @post('/api/blogs/{id}/comments')
@@ -393,6 +416,7 @@ async def api_create_comment(id, request, *, content):
         raise APIResourceNotFoundError('Blog')
     comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip())
     await comment.save()
+    await pages.invalidate(f'/blog/{blog.id}')
     return comment
 
 
@@ -404,4 +428,18 @@ async def api_delete_comments(id, request):
     if c is None:
         raise APIResourceNotFoundError('Comment')
     await c.remove()
+    await pages.invalidate(f'/blog/{c.blog_id}')
     return dict(id=id)
+
+
+@post('/api/comments/delete')
+async def api_delete_comments_batch(request, *, ids):
+    """ 管理员批量删除评论API """
+    check_admin(request)
+    if not isinstance(ids, list) or not ids:
+        raise APIValueError('ids', 'ids must be a non-empty list.')
+    if not all(isinstance(i, str) and i for i in ids):
+        raise APIValueError('ids', 'ids must be non-empty strings.')
+    rows = await Comment.remove_many(ids)
+    await pages.invalidate()
+    return dict(ids=ids, count=rows)
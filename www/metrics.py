@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lightweight in-process metrics.
+"""
+
+from bisect import bisect_left
+
+
+class Histogram:
+    """ 固定分桶的直方图，单位为秒：Histogram with fixed buckets (seconds).
+
+    >>> h = Histogram(buckets=(0.01, 0.1, 1))
+    >>> for v in (0.005, 0.05, 0.05, 2):
+    ...     h.observe(v)
+    >>> h.count, h.max
+    (4, 2)
+    >>> h.percentile(0.5)
+    0.1
+    >>> h.to_dict()['buckets']
+    {'0.01': 1, '0.1': 2, '1': 0, '+Inf': 1}
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """ 估算分位数，返回所在分桶的上界 """
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        labels = [str(b) for b in self.buckets] + ['+Inf']
+        return dict(
+            count=self.count,
+            sum=round(self.sum, 6),
+            avg=round(self.sum / self.count, 6) if self.count else 0,
+            max=round(self.max, 6),
+            p50=self.percentile(0.5),
+            p99=self.percentile(0.99),
+            buckets=dict(zip(labels, self.counts))
+        )
@@ -8,6 +8,7 @@ Models for user, blog, comment.
 import time
 import uuid
 from orm import Model, StringField, BooleanField, FloatField, TextField
+from render import render_markdown, text2html
 
 
 def next_id():
@@ -16,6 +17,7 @@ def next_id():
 
 class User(Model):
     __table__ = 'users'
+    __indexes__ = [('created_at', 'id')]    # 供 keyset 分页使用
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     email = StringField(ddl='varchar(50)')
@@ -28,6 +30,7 @@ class User(Model):
 
 class Blog(Model):
     __table__ = 'blogs'
+    __indexes__ = [('created_at', 'id')]
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     user_id = StringField(ddl='varchar(50)')
@@ -35,12 +38,14 @@ class Blog(Model):
     user_image = StringField(ddl='varchar(500)')
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
-    content = TextField()
+    content = TextField(deferred=True)
+    html_content = TextField(derive=lambda blog: render_markdown(blog.getValue('content')), deferred=True)
     created_at = FloatField(default=time.time)
 
 
 class Comment(Model):
     __table__ = 'comments'
+    __indexes__ = [('created_at', 'id')]
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     blog_id = StringField(ddl='varchar(50)')
@@ -48,4 +53,5 @@ class Comment(Model):
     user_name = StringField(ddl='varchar(50)')
     user_image = StringField(ddl='varchar(500)')
     content = TextField()
+    html_content = TextField(derive=lambda comment: text2html(comment.getValue('content') or ''))
     created_at = FloatField(default=time.time)
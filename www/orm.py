@@ -1,7 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import time
+import asyncio
+import inspect
+import functools
 import logging
+import contextvars
+from contextlib import asynccontextmanager
 import aiomysql
+from apis import Page, CursorPage
+from metrics import Histogram
+from cache import get_cache
 # import asyncio
 
 
@@ -9,10 +18,8 @@ def log(sql, args=()):
     logging.info('SQL: %s' % sql)
 
 
-async def create_pool(loop, **kw):
-    logging.info('Create Database Connection Pool...')
-    global __pool
-    __pool = await aiomysql.create_pool(
+async def _create_pool(loop, **kw):
+    return await aiomysql.create_pool(
         host=kw.get('host', 'localhost'),
         port=kw.get('port', 3306),
         user=kw['user'],
@@ -26,45 +33,355 @@ async def create_pool(loop, **kw):
     )
 
 
+async def create_pool(loop, **kw):
+    """ 创建主库连接池，以及 kw['replicas'] 中每个从库的连接池。
+
+    从库配置中未给出的参数（user、password、db 等）沿用主库的配置；
+    replica_strategy 可以是 'round_robin'（默认）或 'least_connections'。
+    """
+    logging.info('Create Database Connection Pool...')
+    global __pool, __replicas, __replica_strategy, __slow_acquire
+    replicas = kw.pop('replicas', None) or []
+    __replica_strategy = kw.pop('replica_strategy', 'round_robin')
+    __slow_acquire = kw.pop('slow_acquire', 0.1)
+    __pool = await _create_pool(loop, **kw)
+    _pool_metrics[__pool] = PoolMetrics('primary', __pool)
+    __replicas = []
+    for i, r in enumerate(replicas):
+        logging.info(f"Create Replica Connection Pool: {r.get('host', 'localhost')}:{r.get('port', 3306)}")
+        pool = await _create_pool(loop, **dict(kw, **r))
+        _pool_metrics[pool] = PoolMetrics(f'replica-{i}', pool)
+        __replicas.append(pool)
+
+
+async def close_pool():
+    """ 关闭主库和从库的连接池 """
+    for pool in [__pool] + __replicas:
+        if pool is not None:
+            pool.close()
+            await pool.wait_closed()
+
+
+__pool = None
+__replicas = []
+__replica_strategy = 'round_robin'
+__replica_next = 0
+__slow_acquire = 0.1     # 等待连接超过该秒数时记录警告，说明连接池已经饱和
+
+
+class PoolMetrics:
+    """ 连接池的使用情况：等待连接的协程数、获取连接的耗时分布 """
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.waiting = 0
+        self.acquired = 0
+        self.acquire_time = Histogram()
+
+    def to_dict(self):
+        return dict(
+            name=self.name,
+            size=self.pool.size,
+            free=self.pool.freesize,
+            used=self.pool.size - self.pool.freesize,
+            minsize=self.pool.minsize,
+            maxsize=self.pool.maxsize,
+            waiting=self.waiting,
+            acquired=self.acquired,
+            acquire_time=self.acquire_time.to_dict()
+        )
+
+
+_pool_metrics = dict()
+query_time = dict(select=Histogram(), execute=Histogram())
+
+
+def pool_stats():
+    """ 返回所有连接池和查询耗时的统计信息 """
+    return dict(
+        pools=[m.to_dict() for m in _pool_metrics.values()],
+        queries={k: h.to_dict() for k, h in query_time.items()}
+    )
+
+
+@asynccontextmanager
+async def _acquire(pool):
+    """ 从连接池获取连接，并记录等待时间 """
+    metrics = _pool_metrics.get(pool)
+    if metrics is None:
+        metrics = _pool_metrics[pool] = PoolMetrics(f'pool-{len(_pool_metrics)}', pool)
+    start = time.perf_counter()
+    metrics.waiting += 1
+    try:
+        conn = await pool.acquire()
+    finally:
+        metrics.waiting -= 1
+    elapsed = time.perf_counter() - start
+    metrics.acquired += 1
+    metrics.acquire_time.observe(elapsed)
+    if elapsed > __slow_acquire:
+        logging.warning(f'Waited {elapsed:.3f}s for a connection from {metrics.name} pool (size {pool.size}/{pool.maxsize}, waiting {metrics.waiting})')
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+# 事务中绑定到当前协程上下文的连接 (conn, lock)，以及当前的 savepoint 层数
+_transaction = contextvars.ContextVar('orm_transaction', default=None)
+_savepoint = contextvars.ContextVar('orm_savepoint', default=0)
+# 当前请求（协程上下文）是否写过数据库，写过之后的读操作都走主库，保证能读到自己的写入
+_sticky = contextvars.ContextVar('orm_sticky', default=False)
+
+
+# 请求内的对象缓存（identity map）：(表名, 主键) -> 完整的行数据，find() 优先从这里取
+_identity = contextvars.ContextVar('orm_identity', default=None)
+
+
+def begin_request():
+    """ 每个请求开始时调用：清除上一个请求留下的主库读标记，并创建新的请求内对象缓存 """
+    _sticky.set(False)
+    _identity.set(dict())
+
+
+def _remember(cls, row):
+    identity = _identity.get()
+    if identity is not None and all(k in row for k in cls.__mappings__):
+        identity[(cls.__table__, row[cls.__primary_key__])] = dict(row)
+
+
+def _recall(cls, pk):
+    identity = _identity.get()
+    if identity is None:
+        return None
+    row = identity.get((cls.__table__, pk))
+    # 每次返回新的对象，调用方修改对象不会影响缓存
+    return dict(row) if row is not None else None
+
+
+def _forget(cls, pk=None):
+    """ 从请求内缓存中移除一行，pk 为 None 时移除整张表 """
+    identity = _identity.get()
+    if not identity:
+        return
+    if pk is not None:
+        identity.pop((cls.__table__, pk), None)
+    else:
+        for key in [key for key in identity if key[0] == cls.__table__]:
+            del identity[key]
+
+
+def _replica_pool():
+    """ 按策略选择一个从库连接池 """
+    global __replica_next
+    if __replica_strategy == 'least_connections':
+        return min(__replicas, key=lambda p: p.size - p.freesize)
+    pool = __replicas[__replica_next % len(__replicas)]
+    __replica_next += 1
+    return pool
+
+
+@asynccontextmanager
+async def connection(readonly=False):
+    """ 在事务中返回事务绑定的连接，否则从连接池中取一个连接。
+
+    readonly=True 时，如果配置了从库且当前请求还没有写过数据库，使用从库连接。
+    """
+    pinned = _transaction.get()
+    if pinned is not None:
+        conn, lock = pinned
+        # asyncio.gather 等创建的子任务会共享同一连接，需要串行使用
+        async with lock:
+            yield conn
+        return
+    if readonly and __replicas and not _sticky.get():
+        pool = _replica_pool()
+    else:
+        pool = __pool
+    async with _acquire(pool) as conn:
+        yield conn
+
+
+def in_transaction():
+    return _transaction.get() is not None
+
+
+@asynccontextmanager
+async def transaction():
+    """ async with transaction(): 块内的所有 ORM 操作使用同一个连接并在同一个事务中执行。
+
+    出现异常时回滚；嵌套使用时内层通过 savepoint 实现，只回滚内层的修改。
+    """
+    pinned = _transaction.get()
+    if pinned is not None:
+        conn, lock = pinned
+        depth = _savepoint.get() + 1
+        name = f'sp_{depth}'
+        async with lock:
+            await _execute_on(conn, f'savepoint {name}')
+        token = _savepoint.set(depth)
+        try:
+            yield conn
+        except BaseException:
+            async with lock:
+                await _execute_on(conn, f'rollback to savepoint {name}')
+            raise
+        else:
+            async with lock:
+                await _execute_on(conn, f'release savepoint {name}')
+        finally:
+            _savepoint.reset(token)
+        return
+    async with _acquire(__pool) as conn:
+        await conn.begin()
+        token = _transaction.set((conn, asyncio.Lock()))
+        try:
+            yield conn
+        except BaseException:
+            await conn.rollback()
+            # 回滚后缓存的行数和对象可能已经不准确
+            await counter.invalidate()
+            identity = _identity.get()
+            if identity:
+                identity.clear()
+            raise
+        else:
+            await conn.commit()
+        finally:
+            _transaction.reset(token)
+
+
+# 模型的固定语句在定义模型时转换好，常驻内存；其他语句的转换结果放在有上限的 LRU 缓存中
+_prepared = dict()
+
+
+@functools.lru_cache(maxsize=1024)
+def _translate(sql):
+    return sql.replace('?', '%s')
+
+
+def prepare(sql):
+    """ 登记一条常用语句，预先把占位符 ? 转换为 aiomysql 使用的 %s """
+    _prepared[sql] = sql.replace('?', '%s')
+    return sql
+
+
+def translate(sql):
+    """ 返回占位符转换后的语句 """
+    prepared = _prepared.get(sql)
+    if prepared is None:
+        prepared = _translate(sql)
+    return prepared
+
+
+async def _execute_on(conn, sql, args=None):
+    log(sql)
+    async with conn.cursor() as cur:
+        await cur.execute(sql, args)
+        return cur.rowcount
+
+
 async def select(sql, args, size=None):
     log(sql, args)
-    global __pool
-    async with __pool.get() as conn:
+    async with connection(readonly=True) as conn:
+        start = time.perf_counter()
         async with conn.cursor(aiomysql.DictCursor) as cur:
-            await cur.execute(sql.replace('?', '%s'), args or ())
+            await cur.execute(translate(sql), args or ())
             if size:
                 rs = await cur.fetchmany(size)
             else:
                 rs = await cur.fetchall()
+        query_time['select'].observe(time.perf_counter() - start)
         logging.info(f'Rows Returned: {len(rs)}')
         return rs
 
 
 async def execute(sql, args, autocommit=True):
     log(sql)
-    async with __pool.get() as conn:
+    # 已经在事务中时由 transaction() 负责提交
+    autocommit = autocommit or in_transaction()
+    _sticky.set(True)
+    async with connection() as conn:
         if not autocommit:
             await conn.begin()
         try:
+            start = time.perf_counter()
             async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(sql.replace('?', '%s'), args)
+                await cur.execute(translate(sql), args)
                 affected = cur.rowcount
+            query_time['execute'].observe(time.perf_counter() - start)
             if not autocommit:
                 await conn.commit()
         except BaseException:
+            if not autocommit:
+                await conn.rollback()
             raise
         return affected
 
 
+async def execute_many(sql, args_list):
+    """ 用同一条语句批量执行多组参数，只占用一次连接 """
+    log(sql)
+    _sticky.set(True)
+    async with connection() as conn:
+        start = time.perf_counter()
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.executemany(translate(sql), args_list)
+            affected = cur.rowcount
+        query_time['execute'].observe(time.perf_counter() - start)
+        return affected
+
+
+# ====================================================================================================
+class RowCounter:
+    """ 缓存每张表的行数：计数保存在共享缓存中，save()/remove() 时增量维护，超过 ttl 秒后重新统计。
+
+    approximate=True 时从 information_schema 读取 InnoDB 的估算行数，不扫描索引。
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._tables = set()
+
+    @staticmethod
+    def _key(table):
+        return f'count:{table}'
+
+    async def incr(self, table, delta=1):
+        if delta:
+            await get_cache().incr(self._key(table), delta)
+
+    async def invalidate(self, table=None):
+        for t in ([table] if table else list(self._tables)):
+            await get_cache().delete(self._key(t))
+
+    async def count(self, table, approximate=False):
+        async def query():
+            if approximate:
+                rs = await select('select table_rows _num_ from information_schema.tables where table_schema=database() and table_name=?', [table], 1)
+            else:
+                rs = await select(f'select count(*) _num_ from `{table}`', None, 1)
+            return int(rs[0]['_num_'] or 0) if rs else 0
+        self._tables.add(table)
+        # 并发的未命中只会触发一次统计查询
+        return await get_cache().get_or_set(self._key(table), query, self.ttl)
+
+
+counter = RowCounter()
+
+
 # ====================================================================================================
 class Field:
 
-    def __init__(self, name, column_type, primary_key, default, nullable):
+    def __init__(self, name, column_type, primary_key, default, nullable, derive=None):
         self.name = name
         self.column_type = column_type
         self.primary_key = primary_key
         self.default = default
         self.nullable = nullable    # 用于确定它是否可以为空
+        self.derive = derive        # 派生列：save()/update() 时由 derive(model) 计算并持久化
+        self.deferred = False       # 延迟加载：findAll() 默认不查询该列
 
     def __str__(self):
         return f'<{self.__class__.__name__}, {self.column_type}:{self.name}>'
@@ -96,8 +413,9 @@ class FloatField(Field):
 
 class TextField(Field):
 
-    def __init__(self, name=None, default=None, nullable=True):
-        super().__init__(name, 'text', False, default, nullable)
+    def __init__(self, name=None, default=None, nullable=True, derive=None, deferred=False):
+        super().__init__(name, 'text', False, default, nullable, derive)
+        self.deferred = deferred
 
 
 # ====================================================================================================
@@ -157,26 +475,61 @@ class ModelMetaclass(type):
         attrs['__table__'] = tableName              # table 名称
         attrs['__primary_key__'] = primaryKey       # 主键属性名
         attrs['__fields__'] = fields                # 除主键外的属性名
+        attrs['__derived__'] = [k for k in fields if mappings[k].derive]  # 派生列的属性名
+        attrs['__deferred__'] = [k for k in fields if mappings[k].deferred]  # 延迟加载的属性名
         # 构造默认的 Select, Insert, Update, Delete 语句
         attrs['__select__'] = f"select `{primaryKey}`, {', '.join(escaped_fields)} from `{tableName}`"
-        attrs[
-            '__insert__'] = f"insert into `{tableName}` ({', '.join(escaped_fields)}, `{primaryKey}`) values ({create_args_string(len(escaped_fields) + 1)})"
+        # findAll() 默认使用的 Select 语句，不含延迟加载的列
+        attrs['__select_list__'] = f"select `{primaryKey}`, {', '.join(f'`{f}`' for f in fields if not mappings[f].deferred)} from `{tableName}`"
+        attrs['__insert_head__'] = f"insert into `{tableName}` ({', '.join(escaped_fields)}, `{primaryKey}`) values"
+        attrs['__insert_row__'] = f"({create_args_string(len(escaped_fields) + 1)})"
+        attrs['__insert__'] = f"{attrs['__insert_head__']} {attrs['__insert_row__']}"
         attrs[
             '__update__'] = f"update `{tableName}` set {', '.join(map(lambda f: f'`{mappings.get(f).name or f}`=?', fields))} where `{primaryKey}`=?"
         attrs['__delete__'] = f"delete from `{tableName}` where `{primaryKey}`=?"
+        attrs['__find__'] = f"{attrs['__select__']} where `{primaryKey}`=?"
+        attrs['__update_sqls__'] = dict()           # 只更新部分列的 update 语句缓存
+        for key in ('__select__', '__select_list__', '__insert__', '__update__', '__delete__', '__find__'):
+            prepare(attrs[key])
         # 新增动态创建表
-        attrs['__create__'] = "create table if not exists `%s` (%s, primary key (`%s`)) engine=InnoDB default charset=utf8mb4;" % (tableName, get_column_string(mappings), mappings.get(primaryKey).name or primaryKey)
+        indexes = ''.join(', key `idx_%s` (%s)' % ('_'.join(idx), ', '.join(f'`{c}`' for c in idx)) for idx in attrs.get('__indexes__', ()))
+        attrs['__create__'] = "create table if not exists `%s` (%s, primary key (`%s`)%s) engine=InnoDB default charset=utf8mb4;" % (tableName, get_column_string(mappings), mappings.get(primaryKey).name or primaryKey, indexes)
         return type.__new__(cls, name, bases, attrs)
 
 
 class Model(dict, metaclass=ModelMetaclass):
     def __init__(self, **kw):
         super(Model, self).__init__(**kw)
+        # 最近一次与数据库同步时的字段值，用于找出修改过的列；None 表示不知道数据库中的状态
+        object.__setattr__(self, '_snapshot', None)
+
+    @classmethod
+    def fromRow(cls, row):
+        """ 由查询结果构造对象，并标记为未修改 """
+        obj = cls(**row)
+        obj.markClean()
+        return obj
+
+    def markClean(self):
+        object.__setattr__(self, '_snapshot', dict(self))
+
+    def isPartial(self):
+        """ 是否是只加载了部分列的对象 """
+        return self._snapshot is not None and any(k not in self for k in self.__mappings__)
+
+    def changedFields(self):
+        """ 返回自上次同步后修改过的属性名，未从数据库加载的对象视为全部修改 """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return list(self.__fields__)
+        return [k for k in self.__fields__ if k in self and (k not in snapshot or self[k] != snapshot[k])]
 
     def __getattr__(self, key):
         try:
             return self[key]
         except KeyError:
+            if key in self.__mappings__ and self._snapshot is not None:
+                raise AttributeError(f"'{self.__class__.__name__}' field '{key}' is not loaded, use 'await obj.load()' first")
             raise AttributeError(f"'Model' object has no attribute '{key}'")
 
     def __setattr__(self, key, value):
@@ -195,10 +548,21 @@ class Model(dict, metaclass=ModelMetaclass):
                 setattr(self, key, value)
         return value
 
+    @classmethod
+    def getSelectSql(cls, columns=None):
+        """ 只查询指定列（主键总会被查询）的 select 语句，columns 为空时不查询延迟加载的列 """
+        if columns is None:
+            return cls.__select_list__
+        for c in columns:
+            if c not in cls.__mappings__:
+                raise ValueError(f'Invalid field for {cls.__name__}: {c}')
+        columns = [cls.__primary_key__] + [c for c in columns if c != cls.__primary_key__]
+        return f"select {', '.join(f'`{c}`' for c in columns)} from `{cls.__table__}`"
+
     @classmethod
     async def findAll(cls, where=None, args=None, **kw):
-        """ find objects by where clause. """
-        sql = [cls.__select__]
+        """ find objects by where clause. 可以通过 columns 指定要查询的列。 """
+        sql = [cls.getSelectSql(kw.get('columns', None))]
         if where:
             sql.append('where')
             sql.append(where)
@@ -220,7 +584,75 @@ class Model(dict, metaclass=ModelMetaclass):
             else:
                 raise ValueError(f'Invalid limit value: {str(limit)}')
         rs = await select(' '.join(sql), args)
-        return [cls(**r) for r in rs]
+        for r in rs:
+            _remember(cls, r)
+        return [cls.fromRow(r) for r in rs]
+
+    @classmethod
+    async def findSeek(cls, where=None, args=None, *, keys=('created_at', 'id'), after=None, before=None, limit=10, desc=True, columns=None):
+        """ keyset 分页：按 keys 排序，从 after（向后）或 before（向前）给出的键值处开始取 limit 条，不使用 offset。
+        返回 (rows, has_more)，has_more 表示沿翻页方向还有更多数据。
+        """
+        args = list(args or [])
+        conditions = [f'({where})'] if where else []
+        forward = before is None
+        cursor = after if forward else before
+        # 向前翻页时反向排序，取出后再倒回来
+        descending = desc == forward
+        if cursor is not None:
+            if len(cursor) != len(keys):
+                raise ValueError(f'Invalid cursor values: {str(cursor)}')
+            op = '<' if descending else '>'
+            parts = []
+            for i, key in enumerate(keys):
+                parts.append('(%s)' % ' and '.join([f'`{k}`=?' for k in keys[:i]] + [f'`{key}`{op}?']))
+                args.extend(cursor[:i + 1])
+            conditions.append('(%s)' % ' or '.join(parts))
+        orderBy = ', '.join(f"`{k}` {'desc' if descending else 'asc'}" for k in keys)
+        if columns is not None:
+            columns = list(columns) + [k for k in keys if k not in columns]
+        rs = await cls.findAll(' and '.join(conditions) or None, args, orderBy=orderBy, limit=limit + 1, columns=columns)
+        more = len(rs) > limit
+        rs = rs[:limit]
+        if not forward:
+            rs.reverse()
+        return rs, more
+
+    @classmethod
+    async def findCursor(cls, cursor=None, page_size=10, where=None, args=None, keys=('created_at', 'id'), columns=None):
+        """ 按游标取一页数据，返回 items 为数据行的 CursorPage。cursor 为空表示第一页。 """
+        direction, values = CursorPage.decode(cursor, len(keys)) if cursor else ('next', None)
+        if direction == 'next':
+            rs, more = await cls.findSeek(where, args, keys=keys, after=values, limit=page_size, columns=columns)
+            has_next, has_previous = more, values is not None
+        else:
+            rs, more = await cls.findSeek(where, args, keys=keys, before=values, limit=page_size, columns=columns)
+            has_next, has_previous = True, more
+        page = CursorPage(page_size)
+        if rs:
+            if has_next:
+                page.next = CursorPage.encode('next', [rs[-1][k] for k in keys])
+            if has_previous:
+                page.previous = CursorPage.encode('prev', [rs[0][k] for k in keys])
+        page.has_next = page.next is not None
+        page.has_previous = page.previous is not None
+        page.items = rs
+        return page
+
+    @classmethod
+    async def findPage(cls, page_index=1, page_size=10, where=None, args=None, orderBy='created_at desc', columns=None):
+        """ 并发查询总数和当页数据，返回 items 为数据行的 Page。 """
+        if where:
+            num = cls.findNumber('count(*)', where, args)
+        else:
+            num = cls.count()
+        # offset 直接由页码计算，不必等待总数；页码越界时 Page 会把 limit 置 0，丢弃查询结果
+        rows = cls.findAll(where, list(args or []), orderBy=orderBy, limit=(page_size * (page_index - 1), page_size), columns=columns)
+        num, rs = await asyncio.gather(num, rows)
+        page = Page(num or 0, page_index, page_size)
+        if page.limit:
+            page.items = rs
+        return page
 
     @classmethod
     async def findNumber(cls, selectField, where=None, args=None):
@@ -235,34 +667,195 @@ class Model(dict, metaclass=ModelMetaclass):
         return rs[0]['_num_']
 
     @classmethod
-    async def find(cls, pk):
-        """ find object by primary key. """
-        rs = await select(f"{cls.__select__} where `{cls.__primary_key__}`=?", [pk], 1)
+    async def count(cls, approximate=None):
+        """ 返回表的总行数，优先使用缓存的计数。approximate 未指定时使用模型的 __approximate_count__ 设置。 """
+        if approximate is None:
+            approximate = getattr(cls, '__approximate_count__', False)
+        return await counter.count(cls.__table__, approximate)
+
+    @classmethod
+    async def find(cls, pk, columns=None):
+        """ find object by primary key. 默认查询所有列，包括延迟加载的列。同一请求内重复查询时使用请求内缓存。 """
+        if columns is None:
+            row = _recall(cls, pk)
+            if row is not None:
+                return cls.fromRow(row)
+        sql = cls.__find__ if columns is None else f"{cls.getSelectSql(columns)} where `{cls.__primary_key__}`=?"
+        rs = await select(sql, [pk], 1)
         if len(rs) == 0:
             return None
-        return cls(**rs[0])
-
-    async def save(self):
+        _remember(cls, rs[0])
+        return cls.fromRow(rs[0])
+
+    async def load(self, *fields):
+        """ 加载尚未查询的列，fields 为空时加载所有缺少的列 """
+        fields = [k for k in (fields or self.__mappings__) if k not in self]
+        if not fields:
+            return self
+        rs = await select(f"{self.getSelectSql(fields)} where `{self.__primary_key__}`=?", [self.getValue(self.__primary_key__)], 1)
+        if len(rs) == 0:
+            raise ValueError(f'Record not found: {self.__table__}: {self.getValue(self.__primary_key__)}')
+        for k in fields:
+            dict.__setitem__(self, k, rs[0][k])
+            if self._snapshot is not None:
+                self._snapshot[k] = rs[0][k]
+        return self
+
+    async def computeDerived(self):
+        """ 计算所有派生列的值。只加载了部分列的对象：有修改时先加载其余的列再计算，
+            否则派生列会保留旧值；没有修改时不计算，保持原值
+        """
+        if not self.__derived__:
+            return
+        if self.isPartial():
+            if not self.changedFields():
+                return
+            await self.load()
+        for key in self.__derived__:
+            value = self.__mappings__[key].derive(self)
+            # derive 可以是协程函数，例如在进程池中渲染 Markdown
+            if inspect.isawaitable(value):
+                value = await value
+            setattr(self, key, value)
+
+    async def getInsertArgs(self):
+        await self.computeDerived()
         args = list(map(self.getValueOrDefault, self.__fields__))
         args.append(self.getValueOrDefault(self.__primary_key__))
+        return args
+
+    def getUpdateArgs(self, fields):
+        args = list(map(self.getValue, fields))
+        args.append(self.getValue(self.__primary_key__))
+        return args
+
+    @classmethod
+    def getUpdateSql(cls, fields):
+        """ 只更新指定列的 update 语句 """
+        fields = tuple(fields)
+        sql = cls.__update_sqls__.get(fields)
+        if sql is None:
+            if list(fields) == cls.__fields__:
+                sql = cls.__update__
+            else:
+                sql = prepare(f"update `{cls.__table__}` set {', '.join(f'`{cls.__mappings__[f].name or f}`=?' for f in fields)} where `{cls.__primary_key__}`=?")
+            cls.__update_sqls__[fields] = sql
+        return sql
+
+    async def save(self):
+        args = await self.getInsertArgs()
         rows = await execute(self.__insert__, args)
         if rows != 1:
             logging.warning(f'Failed to insert record: affected rows: {rows}')
+        await counter.incr(self.__table__, rows)
+        _forget(self, self.getValue(self.__primary_key__))
+        self.markClean()
 
     async def update(self):
-        args = list(map(self.getValue, self.__fields__))
-        args.append(self.getValue(self.__primary_key__))
-        rows = await execute(self.__update__, args)
+        """ 只写回修改过的列，没有修改时不访问数据库 """
+        await self.computeDerived()
+        fields = self.changedFields()
+        if not fields:
+            logging.info(f'Nothing changed for {self.__table__}: {self.getValue(self.__primary_key__)}')
+            return
+        rows = await execute(self.getUpdateSql(fields), self.getUpdateArgs(fields))
         if rows != 1:
             logging.warning(f'Failed to update by primary key: affected rows: {rows}')
+        _forget(self, self.getValue(self.__primary_key__))
+        self.markClean()
+
+    @classmethod
+    async def updateWhere(cls, set, where=None, args=None):
+        """ 用一条 update 语句批量更新满足 where 的行，返回受影响的行数。
+
+        set 可以是 {属性名: 值} 的字典，也可以是 SQL 片段（如 "`name`=concat(`name`, ?)"），
+        SQL 片段中的参数放在 args 的最前面。派生列不会被重新计算。
+        """
+        args = list(args or [])
+        if isinstance(set, dict):
+            if not set:
+                return 0
+            for k in set:
+                if k not in cls.__fields__:
+                    raise ValueError(f'Invalid field for {cls.__name__}: {k}')
+            assignments = ', '.join(f'`{cls.__mappings__[k].name or k}`=?' for k in set)
+            args = list(set.values()) + args
+        else:
+            assignments = set
+        sql = [f'update `{cls.__table__}` set {assignments}']
+        if where:
+            sql.append('where')
+            sql.append(where)
+        _forget(cls)
+        return await execute(' '.join(sql), args)
 
     async def remove(self):
         args = [self.getValue(self.__primary_key__)]
         rows = await execute(self.__delete__, args)
         if rows != 1:
             logging.warning(f'Failed to remove by primary key: affected rows: {rows}')
+        await counter.incr(self.__table__, -rows)
+        _forget(self, args[0])
 
     @classmethod
     async def create(cls):
         """ Create table if table (with the same name) not exists. """
         await execute(cls.__create__, None)
+
+    # ------------------------------------------------------------------------------------------------
+    # 批量操作：按 chunk_size 分批，每批一次连接、一次往返
+
+    @classmethod
+    async def save_many(cls, models, chunk_size=500):
+        """ 批量插入，每批使用一条多行 insert ... values (...), (...) 语句，返回插入的行数。 """
+        total = 0
+        for i in range(0, len(models), chunk_size):
+            chunk = models[i:i + chunk_size]
+            args = []
+            for m in chunk:
+                args.extend(await m.getInsertArgs())
+            sql = f"{cls.__insert_head__} {', '.join([cls.__insert_row__] * len(chunk))}"
+            rows = await execute(sql, args)
+            if rows != len(chunk):
+                logging.warning(f'Failed to insert records: expected {len(chunk)}, affected rows: {rows}')
+            await counter.incr(cls.__table__, rows)
+            for m in chunk:
+                m.markClean()
+            total += rows
+        return total
+
+    @classmethod
+    async def update_many(cls, models, chunk_size=500):
+        """ 批量按主键更新，修改了相同列的对象归为一组，每批通过 executemany 执行，返回受影响的行数。 """
+        groups = dict()
+        for m in models:
+            await m.computeDerived()
+            fields = tuple(m.changedFields())
+            if fields:
+                groups.setdefault(fields, []).append(m)
+        total = 0
+        for fields, group in groups.items():
+            sql = cls.getUpdateSql(fields)
+            for i in range(0, len(group), chunk_size):
+                chunk = group[i:i + chunk_size]
+                total += await execute_many(sql, [m.getUpdateArgs(fields) for m in chunk])
+                for m in chunk:
+                    _forget(cls, m.getValue(cls.__primary_key__))
+                    m.markClean()
+        return total
+
+    @classmethod
+    async def remove_many(cls, models, chunk_size=500):
+        """ 批量按主键删除，models 可以是对象也可以是主键值，每批一条 delete ... in (...) 语句。 """
+        pks = [m.getValue(cls.__primary_key__) if isinstance(m, Model) else m for m in models]
+        total = 0
+        for i in range(0, len(pks), chunk_size):
+            chunk = pks[i:i + chunk_size]
+            rows = await execute(f"delete from `{cls.__table__}` where `{cls.__primary_key__}` in ({create_args_string(len(chunk))})", chunk)
+            if rows != len(chunk):
+                logging.warning(f'Failed to remove records: expected {len(chunk)}, affected rows: {rows}')
+            await counter.incr(cls.__table__, -rows)
+            for pk in chunk:
+                _forget(cls, pk)
+            total += rows
+        return total
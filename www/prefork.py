@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prefork supervisor: run N worker processes sharing one listening port.
+
+主进程只负责监听端口和管理子进程，不运行事件循环：
+  - reuse_port=False 时主进程创建监听 socket，通过 fd 继承给每个子进程；
+  - reuse_port=True 时每个子进程各自用 SO_REUSEPORT 绑定同一端口，由内核分配连接。
+子进程异常退出时自动重启；收到 SIGHUP 时先启动一组新的子进程，等它们都开始监听后再让旧的子进程优雅退出
+（可用于发布新代码），收到 SIGTERM/SIGINT 时通知所有子进程优雅退出。
+子进程开始监听后调用 notify_ready()，通过环境变量 READY_ENV 给出的管道通知主进程。
+"""
+
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+GRACEFUL_TIMEOUT = 30       # 子进程优雅退出的最长等待秒数
+RESPAWN_DELAY = 1           # 子进程启动后很快退出时，重启前等待的秒数
+READY_TIMEOUT = 60          # 平滑重启时等待新子进程开始监听的最长秒数
+READY_ENV = 'AWESOME_READY_FD'
+
+
+def create_socket(host, port, reuse_port=False, backlog=1024):
+    """ 创建非阻塞的监听 socket """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class Supervisor:
+    """ 启动并看管 workers 个子进程，command 为启动子进程的命令，末尾会追加监听 socket 的 fd """
+
+    def __init__(self, command, workers, host, port, reuse_port=False):
+        self.command = command
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.sock = None
+        self._procs = dict()        # Popen -> 启动时间
+        self._ready = dict()        # Popen -> 接收就绪通知的管道读端
+        self._retiring = set()      # 正在优雅退出、不需要重启的旧子进程
+        self._reload = False
+        self._stop = False
+
+    def spawn(self):
+        r, w = os.pipe()
+        env = dict(os.environ, **{READY_ENV: str(w)})
+        try:
+            if self.sock is not None:
+                fd = self.sock.fileno()
+                proc = subprocess.Popen(self.command + [str(fd)], pass_fds=(fd, w), env=env)
+            else:
+                proc = subprocess.Popen(self.command, pass_fds=(w,), env=env)
+        except BaseException:
+            os.close(r)
+            raise
+        finally:
+            os.close(w)
+        logging.info(f'Started worker [{proc.pid}]')
+        self._procs[proc] = time.time()
+        self._ready[proc] = r
+        return proc
+
+    def wait_ready(self, procs, timeout=READY_TIMEOUT):
+        """ 等待 procs 发出就绪通知，返回已就绪的子进程；子进程在就绪前退出时管道读到 EOF """
+        waiting = {self._ready[p]: p for p in procs if p in self._ready}
+        ready = set()
+        deadline = time.time() + timeout
+        while waiting:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(list(waiting), [], [], remaining)
+            for fd in readable:
+                proc = waiting.pop(fd)
+                if os.read(fd, 1):
+                    ready.add(proc)
+        return ready
+
+    def _forget(self, proc):
+        fd = self._ready.pop(proc, None)
+        if fd is not None:
+            os.close(fd)
+
+    def retire(self, proc):
+        self._retiring.add(proc)
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+
+    def reap(self):
+        """ 回收已退出的子进程，意外退出的子进程会被重启 """
+        for proc, started in list(self._procs.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del self._procs[proc]
+            self._forget(proc)
+            if proc in self._retiring:
+                self._retiring.discard(proc)
+                logging.info(f'Worker [{proc.pid}] stopped.')
+                continue
+            logging.warning(f'Worker [{proc.pid}] exited unexpectedly with code {code}.')
+            if not self._stop:
+                if time.time() - started < RESPAWN_DELAY:
+                    time.sleep(RESPAWN_DELAY)
+                self.spawn()
+
+    def restart(self):
+        """ 平滑重启：新子进程全部开始接受连接后，旧子进程才处理完已有请求退出；
+            新子进程没有全部就绪时放弃本次重启，保留旧子进程
+        """
+        logging.info('Graceful restart...')
+        old = [p for p in self._procs if p not in self._retiring]
+        new = [self.spawn() for _ in range(self.workers)]
+        if len(self.wait_ready(new)) < len(new):
+            logging.error('New workers failed to become ready, keep the old workers.')
+            for proc in new:
+                self.retire(proc)
+            return False
+        for proc in old:
+            self.retire(proc)
+        return True
+
+    def stop(self):
+        logging.info('Stopping workers...')
+        for proc in list(self._procs):
+            self.retire(proc)
+        deadline = time.time() + GRACEFUL_TIMEOUT
+        for proc in list(self._procs):
+            try:
+                proc.wait(max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                logging.warning(f'Kill worker [{proc.pid}]')
+                proc.kill()
+                proc.wait()
+        for proc in list(self._ready):
+            self._forget(proc)
+        self._procs.clear()
+        if self.sock is not None:
+            self.sock.close()
+
+    def run(self):
+        if not self.reuse_port:
+            self.sock = create_socket(self.host, self.port)
+            self.sock.set_inheritable(True)
+
+        def on_reload(signum, frame):
+            self._reload = True
+
+        def on_stop(signum, frame):
+            self._stop = True
+
+        signal.signal(signal.SIGHUP, on_reload)
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        for _ in range(self.workers):
+            self.spawn()
+        logging.info(f'Master [{os.getpid()}] serving http://{self.host}:{self.port} with {self.workers} workers...')
+        while not self._stop:
+            time.sleep(0.5)
+            self.reap()
+            if self._reload:
+                self._reload = False
+                self.restart()
+        self.stop()
+
+
+def notify_ready():
+    """ 在子进程中调用：已经开始监听，通知主进程可以让旧的子进程退出 """
+    fd = os.environ.pop(READY_ENV, None)
+    if fd is None:
+        return
+    os.write(int(fd), b'1')
+    os.close(int(fd))
+
+
+def inherited_socket(argv=None):
+    """ 在子进程中取回主进程传下来的监听 socket，没有时返回 None """
+    argv = sys.argv if argv is None else argv
+    if len(argv) < 3:
+        return None
+    return socket.socket(fileno=int(argv[2]))
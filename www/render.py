@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown / plain text rendering with a content-addressed HTML cache.
+
+较长的 Markdown 在进程池中渲染（RenderService），避免纯 Python 的正则处理阻塞事件循环。
+"""
+
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from markdown2 import markdown
+
+from apis import APIError
+from cache import LRUCache
+
+
+# 传给 markdown2 的参数，参与缓存键的计算，修改后旧缓存自然失效
+MARKDOWN_OPTIONS = dict()
+
+# max_bytes 按 UTF-8 编码后的字节数计算，中文字符占 3 个字节
+_html_cache = LRUCache(max_items=512, max_bytes=32 * 1024 * 1024, sizeof=lambda s: len(s.encode('utf-8')))
+
+
+def markdown_key(content, options=None):
+    """ 由 Markdown 正文和渲染参数计算缓存键 """
+    options = MARKDOWN_OPTIONS if options is None else options
+    sha1 = hashlib.sha1()
+    sha1.update(repr(sorted(options.items())).encode('utf-8'))
+    sha1.update(b':')
+    sha1.update(content.encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def markdown2html(content, options=None):
+    """ Markdown转HTML，相同正文只渲染一次 """
+    if not content:
+        return ''
+    options = MARKDOWN_OPTIONS if options is None else options
+    key = markdown_key(content, options)
+    html = _html_cache.get(key)
+    if html is None:
+        logging.info(f'Render markdown: {len(content)} chars')
+        html = markdown(content, **options)
+        _html_cache.set(key, html)
+    return html
+
+
+def text2html(text):
+    """ 文本转HTML """
+    lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', text.split('\n')))
+    return ''.join(lines)
+
+
+def invalidate_markdown(content, options=None):
+    """ 从缓存中移除正文对应的HTML """
+    if content:
+        _html_cache.delete(markdown_key(content, options))
+
+
+# ====================================================================================================
+class RenderBusyError(APIError):
+    """ 渲染队列已满或渲染超时 """
+    def __init__(self, message=''):
+        super(RenderBusyError, self).__init__('render:busy', 'content', message)
+
+
+def _render(content, options):
+    """ 在子进程中执行的渲染函数 """
+    return markdown(content, **options)
+
+
+class RenderService:
+    """ 在进程池中渲染 Markdown。
+
+    最多 workers 个渲染同时进行，排队中的请求超过 max_pending 时直接拒绝（背压），
+    排队加渲染超过 timeout 秒时放弃等待；短于 inline_below 个字符的正文直接在当前进程渲染，
+    因为进程间传输的开销比渲染本身更大。未调用 start() 时所有渲染都在当前进程进行。
+    """
+
+    def __init__(self, workers=2, max_pending=32, timeout=5.0, inline_below=4096):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.inline_below = inline_below
+        self.pending = 0
+        self._executor = None
+        self._semaphore = None
+
+    def start(self):
+        if self.workers > 0 and self._executor is None:
+            logging.info(f'Start markdown render pool: {self.workers} processes')
+            self._executor = ProcessPoolExecutor(self.workers)
+            self._semaphore = asyncio.Semaphore(self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _submit(self, content, options, key):
+        """ 提交到进程池，返回进程池的 Future。
+
+        并发位置和 pending 计数一直保留到子进程真正渲染完成：超时只是放弃等待，子进程仍在渲染，
+        提前释放会让进程池内部无限排队。超时后才完成的结果仍然写入缓存。
+        """
+        loop = asyncio.get_event_loop()
+
+        def done(future):
+            self._semaphore.release()
+            self.pending -= 1
+            if not future.cancelled() and future.exception() is None:
+                _html_cache.set(key, future.result())
+
+        future = loop.run_in_executor(self._executor, _render, content, options)
+        future.add_done_callback(done)
+        return future
+
+    async def markdown2html(self, content, options=None):
+        """ Markdown转HTML，结果与 markdown2html() 共用缓存 """
+        if not content:
+            return ''
+        options = MARKDOWN_OPTIONS if options is None else options
+        if self._executor is None or len(content) < self.inline_below:
+            return markdown2html(content, options)
+        key = markdown_key(content, options)
+        html = _html_cache.get(key)
+        if html is not None:
+            return html
+        if self.pending >= self.max_pending:
+            logging.warning(f'Markdown render queue is full: {self.pending} pending')
+            raise RenderBusyError('Too many pending renders, please retry later.')
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout
+        self.pending += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except BaseException as e:
+            self.pending -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                logging.warning(f'Markdown render queue wait timed out after {self.timeout}s')
+                raise RenderBusyError('Render timed out.')
+            raise
+        logging.info(f'Render markdown in process pool: {len(content)} chars')
+        future = self._submit(content, options, key)
+        try:
+            # shield：超时或请求被取消时不取消进程池中的任务，由它完成后释放位置
+            return await asyncio.wait_for(asyncio.shield(future), max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            logging.warning(f'Markdown render timed out after {self.timeout}s: {len(content)} chars')
+            raise RenderBusyError('Render timed out.')
+
+
+service = RenderService()
+
+
+def setup(**kw):
+    """ 按配置启动渲染进程池 """
+    global service
+    service.shutdown()
+    service = RenderService(**kw)
+    service.start()
+    return service
+
+
+async def render_markdown(content, options=None):
+    """ 使用渲染服务把 Markdown 转为 HTML """
+    return await service.markdown2html(content, options)
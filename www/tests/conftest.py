@@ -0,0 +1,5 @@
+import os
+import sys
+
+# www 下的模块按顶层模块导入（python3 app.py 的运行方式）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+import pytest
+
+from apis import CursorPage, APIValueError
+
+
+def test_cursor_round_trip():
+    cursor = CursorPage.encode('prev', [1500000000.5, '0015'])
+    assert CursorPage.decode(cursor, 2) == ('prev', [1500000000.5, '0015'])
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-a-cursor',
+    CursorPage.encode('up', [1, 'a']),
+    CursorPage.encode('next', [1, 2, 3]),
+    CursorPage.encode('next', [[1], 'a']),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(APIValueError) as e:
+        CursorPage.decode(cursor, 2)
+    assert e.value.data == 'cursor'
@@ -0,0 +1,132 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import app as appmod
+import assets
+import cache
+import compress
+from coroweb import get, add_static, RequestHandler
+
+
+@get('/page', cache=True)
+async def page():
+    return {'__template__': 'page.html', 'title': 'hello'}
+
+
+def make_app(tmp_path, stream):
+    (tmp_path / 'page.html').write_text('<h1>{{ title }}</h1>', encoding='utf-8')
+    app = web.Application(middlewares=[
+        appmod.logger_factory, appmod.compress_factory, appmod.conditional_factory, appmod.page_cache_factory,
+        appmod.orm_factory, appmod.auth_factory, appmod.response_factory
+    ])
+    app['__compressor__'] = compress.Compressor()
+    appmod.init_jinja2(app, path=str(tmp_path), stream=stream)
+    app.router.add_route('GET', '/page', RequestHandler(app, page))
+    return app
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('stream', [False, True])
+async def test_cached_page_renders_with_stream_enabled(tmp_path, stream):
+    cache.setup('memory', page_ttl=60)
+    async with TestClient(TestServer(make_app(tmp_path, stream))) as client:
+        resp = await client.get('/page')
+        assert resp.status == 200
+        assert await resp.text() == '<h1>hello</h1>'
+        assert resp.headers['X-Cache'] == 'MISS'
+        resp = await client.get('/page')
+        assert resp.status == 200
+        assert await resp.text() == '<h1>hello</h1>'
+        assert resp.headers['X-Cache'] == 'HIT'
+
+
+@pytest.mark.asyncio
+async def test_static_files_bypass_middlewares(tmp_path, monkeypatch):
+    cache.setup('memory', page_ttl=60)
+    static_dir = tmp_path / 'static'
+    (static_dir / 'css').mkdir(parents=True)
+    (static_dir / 'css' / 'a.css').write_text('body { color: red; }' * 100, encoding='utf-8')
+    app = make_app(tmp_path, False)
+    files = assets.setup(str(static_dir), str(tmp_path / 'build'))
+    add_static(app, files)
+    calls = []
+    monkeypatch.setattr(appmod.orm, 'begin_request', lambda: calls.append(1))
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.get(files.url('css/a.css'), headers={'Accept-Encoding': 'gzip'})
+        assert resp.status == 200
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert resp.headers['Cache-Control'] == assets.IMMUTABLE
+        assert await resp.text() == 'body { color: red; }' * 100
+        assert calls == []
+        await client.get('/page')
+        assert calls == [1]
+
+
+@get('/validated')
+async def validated():
+    return {'__template__': 'page.html', '__etag__': 'v1', 'title': 'hello'}
+
+
+@pytest.mark.asyncio
+async def test_template_etag_changes_with_relative_time(tmp_path, monkeypatch):
+    app = make_app(tmp_path, False)
+    app.router.add_route('GET', '/validated', RequestHandler(app, validated))
+    now = 1700000000.0
+    monkeypatch.setattr(appmod.time, 'time', lambda: now)
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.get('/validated')
+        etag = resp.headers['ETag']
+        resp = await client.get('/validated', headers={'If-None-Match': etag})
+        assert resp.status == 304
+        now += 60
+        resp = await client.get('/validated', headers={'If-None-Match': etag})
+        assert resp.status == 200
+        assert resp.headers['ETag'] != etag
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('path', ['/page', '/validated'])
+async def test_not_modified_has_same_validators(tmp_path, path):
+    cache.setup('memory', page_ttl=0)
+    app = make_app(tmp_path, False)
+    app.router.add_route('GET', '/validated', RequestHandler(app, validated))
+    (tmp_path / 'page.html').write_text('<h1>{{ title }}</h1>' * 200, encoding='utf-8')
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.get(path, headers={'Accept-Encoding': 'gzip'})
+        assert resp.status == 200
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        etag = resp.headers['ETag']
+        assert etag.startswith('W/')
+        resp = await client.get(path, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        assert resp.status == 304
+        assert resp.headers['ETag'] == etag
+        assert resp.headers['Vary'] == 'Accept-Encoding'
+
+
+def test_prefork_requires_shared_cache():
+    from config import Dict
+    with pytest.raises(SystemExit):
+        appmod.check_workers(Dict(workers=4), Dict(backend='memory'))
+    appmod.check_workers(Dict(workers=4), Dict(backend='memcached'))
+    appmod.check_workers(Dict(workers=1), Dict(backend='memory'))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('identity, gzip;q=0', None),
+    ('gzip;q=0, *', None),
+    ('br, gzip', 'gzip'),
+    ('', None),
+])
+async def test_static_encoding_honours_q_values(tmp_path, accept_encoding, expected):
+    static_dir = tmp_path / 'static'
+    static_dir.mkdir()
+    (static_dir / 'a.js').write_text('var a = 1;\n' * 100, encoding='utf-8')
+    app = web.Application()
+    files = assets.setup(str(static_dir), str(tmp_path / 'build'))
+    add_static(app, files)
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.get(files.url('a.js'), headers={'Accept-Encoding': accept_encoding})
+        assert resp.status == 200
+        assert resp.headers.get('Content-Encoding') == expected
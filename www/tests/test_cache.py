@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from cache import MemcachedCache
+
+
+class FakeMemcached:
+    """ 本地的 memcached 文本协议替身，只实现 get/set/add/delete/incr/decr """
+
+    def __init__(self):
+        self.data = dict()
+        self.keys = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            parts = line.split()
+            command, key = parts[0], parts[1]
+            self.keys.append(key)
+            if len(key) > 250:
+                writer.write(b'CLIENT_ERROR line format\r\n')
+            elif command == b'get':
+                if key in self.data:
+                    flags, value = self.data[key]
+                    writer.write(b'VALUE %s %d %d\r\n%s\r\nEND\r\n' % (key, flags, len(value), value))
+                else:
+                    writer.write(b'END\r\n')
+            elif command in (b'set', b'add'):
+                value = (await reader.readexactly(int(parts[4]) + 2))[:-2]
+                if command == b'add' and key in self.data:
+                    writer.write(b'NOT_STORED\r\n')
+                else:
+                    self.data[key] = (int(parts[2]), value)
+                    writer.write(b'STORED\r\n')
+            elif command == b'delete':
+                writer.write(b'DELETED\r\n' if self.data.pop(key, None) else b'NOT_FOUND\r\n')
+            elif command in (b'incr', b'decr'):
+                if key not in self.data:
+                    writer.write(b'NOT_FOUND\r\n')
+                else:
+                    flags, value = self.data[key]
+                    delta = int(parts[2]) if command == b'incr' else -int(parts[2])
+                    value = str(max(0, int(value) + delta)).encode('ascii')
+                    self.data[key] = (flags, value)
+                    writer.write(value + b'\r\n')
+            await writer.drain()
+        writer.close()
+
+
+@pytest_asyncio.fixture
+async def memcached():
+    server = FakeMemcached()
+    port = await server.start()
+    yield server, MemcachedCache(port=port)
+    await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_get_set_delete(memcached):
+    _, mc = memcached
+    assert await mc.get('missing') is None
+    for key, value in (('bytes', b'<h1>x</h1>'), ('int', 42), ('obj', {'id': '001', 'admin': False}), ('bool', True)):
+        assert await mc.set(key, value)
+        assert await mc.get(key) == value
+    assert await mc.delete('bytes')
+    assert await mc.get('bytes') is None
+
+
+@pytest.mark.asyncio
+async def test_incr_uses_add_for_missing_keys(memcached):
+    _, mc = memcached
+    assert await mc.incr('counter') is None
+    assert await mc.incr('counter', initial=10) == 10
+    assert await mc.incr('counter', 5, initial=10) == 15
+    assert await mc.incr('counter', -20) == 0
+
+
+@pytest.mark.asyncio
+async def test_long_non_ascii_keys_are_hashed(memcached):
+    server, mc = memcached
+    key = 'page:1:2:/blog?q=' + '日志' * 40       # 少于 200 个字符，但超过 250 字节
+    assert len(key) < 200 and len(key.encode('utf-8')) > 250
+    assert await mc.set(key, b'html')
+    assert await mc.get(key) == b'html'
+    assert all(len(k) <= 250 for k in server.keys)
+
+
+@pytest.mark.asyncio
+async def test_get_or_set_coalesces_concurrent_misses(memcached):
+    _, mc = memcached
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 7
+
+    results = await asyncio.gather(*(mc.get_or_set('count:blogs', factory) for _ in range(5)))
+    assert results == [7] * 5
+    assert calls == [1]
+    assert await mc.get('count:blogs') == 7
+
+
+@pytest.mark.asyncio
+async def test_unavailable_server_is_a_miss():
+    mc = MemcachedCache(port=1, timeout=0.2)
+    assert await mc.get('key') is None
+    assert not await mc.set('key', b'value')
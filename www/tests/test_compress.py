@@ -0,0 +1,20 @@
+import pytest
+
+from compress import Compressor
+
+
+class Request:
+    def __init__(self, accept_encoding):
+        self.headers = {'Accept-Encoding': accept_encoding}
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', 'gzip'),
+    ('gzip;q=0, *', None),
+    ('identity, gzip;q=0', None),
+    ('*', 'gzip'),
+    ('', None),
+    ('deflate', None),
+])
+def test_choose(header, expected):
+    assert Compressor(encodings=['gzip']).choose(Request(header)) == expected
@@ -0,0 +1,17 @@
+import pytest
+
+import handlers
+from apis import APIValueError
+from models import User
+
+
+class Request:
+    __user__ = User(id='admin', admin=True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('ids', [[], 'abc', [['001']], [{'id': '001'}], ['001', ''], ['001', 2]])
+async def test_batch_delete_rejects_invalid_ids(ids):
+    with pytest.raises(APIValueError) as e:
+        await handlers.api_delete_comments_batch(Request(), ids=ids)
+    assert e.value.data == 'ids'
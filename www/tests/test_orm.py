@@ -0,0 +1,205 @@
+import pytest
+import pytest_asyncio
+
+import orm
+from models import User, Blog, Comment
+
+
+class FakeDB:
+    """ 替换 orm.select / orm.execute / orm.execute_many，记录生成的 SQL 和参数 """
+
+    def __init__(self):
+        self.rows = []          # 每次 select 依次返回的结果
+        self.sqls = []
+
+    async def select(self, sql, args, size=None):
+        self.sqls.append((sql, list(args or [])))
+        return self.rows.pop(0) if self.rows else []
+
+    async def execute(self, sql, args, autocommit=True):
+        self.sqls.append((sql, list(args or [])))
+        return 1
+
+    async def execute_many(self, sql, args_list):
+        self.sqls.append((sql, [list(args) for args in args_list]))
+        return len(args_list)
+
+
+@pytest_asyncio.fixture
+async def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(orm, 'select', fake.select)
+    monkeypatch.setattr(orm, 'execute', fake.execute)
+    monkeypatch.setattr(orm, 'execute_many', fake.execute_many)
+    orm.begin_request()
+    return fake
+
+
+def blog_row(**kw):
+    row = dict(id='b1', user_id='u1', user_name='name', user_image='image', name='title', summary='summary',
+               content='# old', html_content='<h1>old</h1>', created_at=1.0)
+    row.update(kw)
+    return row
+
+
+@pytest.mark.asyncio
+async def test_partial_update_recomputes_derived_columns(db):
+    db.rows = [[{'id': 'b1', 'content': '# old'}], [blog_row()]]
+    blog = await Blog.find('b1', columns=['content'])
+    blog.content = '# new'
+    await blog.update()
+    sql, args = db.sqls[-1]
+    assert sql.startswith('update `blogs` set')
+    assert '`content`=?' in sql and '`html_content`=?' in sql
+    assert '# new' in args and any('<h1>new</h1>' in str(a) for a in args)
+    assert args[-1] == 'b1'
+
+
+@pytest.mark.asyncio
+async def test_partial_update_many_recomputes_derived_columns(db):
+    db.rows = [[{'id': 'b1', 'content': '# old'}], [blog_row()]]
+    blog = await Blog.find('b1', columns=['content'])
+    blog.content = '# new'
+    await Blog.update_many([blog])
+    sql, args_list = db.sqls[-1]
+    assert '`html_content`=?' in sql
+    assert any('<h1>new</h1>' in str(a) for a in args_list[0])
+
+
+@pytest.mark.asyncio
+async def test_unchanged_partial_object_is_not_loaded(db):
+    db.rows = [[{'id': 'b1', 'content': '# old'}]]
+    blog = await Blog.find('b1', columns=['content'])
+    await blog.update()
+    assert len(db.sqls) == 1
+
+
+class FakePool:
+    size = 1
+    maxsize = 1
+
+    def __init__(self):
+        self.used = []
+
+    async def acquire(self):
+        self.used.append('conn')
+        return 'conn'
+
+    async def release(self, conn):
+        self.used.remove(conn)
+
+
+@pytest.mark.asyncio
+async def test_acquire_uses_pool_acquire_and_release():
+    pool = FakePool()
+    async with orm._acquire(pool) as conn:
+        assert conn == 'conn'
+        assert pool.used == ['conn']
+    assert pool.used == []
+    assert orm._pool_metrics[pool].acquired == 1
+
+
+
+def user_row(**kw):
+    row = dict(id='u1', email='a@b.c', passwd='x', admin=False, name='old', image='img', created_at=1.0)
+    row.update(kw)
+    return row
+
+
+def test_changed_fields():
+    assert User(name='new').changedFields() == User.__fields__
+    user = User.fromRow(user_row())
+    assert user.changedFields() == []
+    user.name = 'new'
+    user.admin = False
+    assert user.changedFields() == ['name']
+    user.markClean()
+    assert user.changedFields() == []
+
+
+@pytest.mark.asyncio
+async def test_update_writes_only_changed_columns(db):
+    user = User.fromRow(user_row())
+    user.name = 'new'
+    user.image = 'img2'
+    await user.update()
+    assert db.sqls == [('update `users` set `name`=?, `image`=? where `id`=?', ['new', 'img2', 'u1'])]
+    # 写回后对象与数据库一致，再次 update 不访问数据库
+    await user.update()
+    assert len(db.sqls) == 1
+
+
+@pytest.mark.asyncio
+async def test_update_without_changes_skips_database(db):
+    await User.fromRow(user_row()).update()
+    assert db.sqls == []
+
+
+@pytest.mark.asyncio
+async def test_update_of_new_object_writes_all_columns(db):
+    user = User(**user_row())
+    await user.update()
+    assert db.sqls == [(User.__update__, ['a@b.c', 'x', False, 'old', 'img', 1.0, 'u1'])]
+
+
+@pytest.mark.asyncio
+async def test_update_of_partial_object_writes_loaded_columns(db):
+    db.rows = [[{'id': 'u1', 'name': 'old'}]]
+    user = await User.find('u1', columns=['name'])
+    user.name = 'new'
+    await user.update()
+    assert db.sqls[-1] == ('update `users` set `name`=? where `id`=?', ['new', 'u1'])
+
+
+@pytest.mark.asyncio
+async def test_update_sql_is_cached_per_column_set():
+    assert User.getUpdateSql(['name', 'image']) is User.getUpdateSql(('name', 'image'))
+    assert User.getUpdateSql(User.__fields__) == User.__update__
+
+
+@pytest.mark.asyncio
+async def test_find_seek_after_descending(db):
+    await Comment.findSeek('blog_id=?', ['b1'], after=[2.0, 'c9'], limit=5)
+    sql, args = db.sqls[-1]
+    assert sql.endswith('from `comments` where (blog_id=?) and ((`created_at`<?) or (`created_at`=? and `id`<?)) '
+                        'order by `created_at` desc, `id` desc limit ?')
+    assert args == ['b1', 2.0, 2.0, 'c9', 6]
+
+
+@pytest.mark.asyncio
+async def test_find_seek_before_reverses_order_and_rows(db):
+    db.rows = [[dict(id='c3', created_at=3.0), dict(id='c4', created_at=4.0)]]
+    rows, more = await Comment.findSeek(before=[2.0, 'c2'], limit=5, columns=['id'])
+    sql, args = db.sqls[-1]
+    assert sql == ('select `id`, `created_at` from `comments` where ((`created_at`>?) or (`created_at`=? and `id`>?)) '
+                   'order by `created_at` asc, `id` asc limit ?')
+    assert args == [2.0, 2.0, 'c2', 6]
+    assert [r.id for r in rows] == ['c4', 'c3'] and not more
+
+
+@pytest.mark.asyncio
+async def test_find_seek_reports_more_rows(db):
+    db.rows = [[dict(id=f'c{i}', created_at=float(i)) for i in range(3)]]
+    rows, more = await Comment.findSeek(limit=2, columns=['id'])
+    assert len(rows) == 2 and more
+    assert 'where' not in db.sqls[-1][0]
+
+
+@pytest.mark.asyncio
+async def test_update_where_with_dict(db):
+    await Comment.updateWhere({'user_name': 'x', 'user_image': 'y'}, 'user_id=?', ['u1'])
+    assert db.sqls == [('update `comments` set `user_name`=?, `user_image`=? where user_id=?', ['x', 'y', 'u1'])]
+
+
+@pytest.mark.asyncio
+async def test_update_where_with_sql_fragment(db):
+    await Comment.updateWhere('`user_name`=concat(`user_name`, ?)', 'user_id=?', [' (deleted)', 'u1'])
+    assert db.sqls == [('update `comments` set `user_name`=concat(`user_name`, ?) where user_id=?', [' (deleted)', 'u1'])]
+
+
+@pytest.mark.asyncio
+async def test_update_where_rejects_unknown_fields(db):
+    with pytest.raises(ValueError):
+        await Comment.updateWhere({'nope': 1})
+    assert await Comment.updateWhere({}) == 0
+    assert db.sqls == []
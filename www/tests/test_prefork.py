@@ -0,0 +1,43 @@
+import sys
+import time
+
+import prefork
+
+READY_AFTER = '''
+import os, time
+time.sleep(%s)
+fd = int(os.environ['AWESOME_READY_FD'])
+os.write(fd, b'1')
+os.close(fd)
+time.sleep(30)
+'''
+
+
+def supervisor(delay):
+    return prefork.Supervisor([sys.executable, '-c', READY_AFTER % delay], 1, '127.0.0.1', 0, reuse_port=True)
+
+
+def test_restart_retires_old_workers_after_new_ones_are_ready():
+    sup = supervisor(0.3)
+    try:
+        old = sup.spawn()
+        assert sup.wait_ready([old], 5) == {old}
+        start = time.time()
+        assert sup.restart()
+        assert time.time() - start >= 0.3
+        assert old in sup._retiring
+        assert len([p for p in sup._procs if p not in sup._retiring]) == 1
+    finally:
+        sup.stop()
+
+
+def test_restart_keeps_old_workers_when_new_ones_fail():
+    sup = supervisor(0.1)
+    try:
+        old = sup.spawn()
+        sup.command = [sys.executable, '-c', 'raise SystemExit(1)']
+        assert not sup.restart()
+        assert old not in sup._retiring
+        assert old.poll() is None
+    finally:
+        sup.stop()
@@ -0,0 +1,58 @@
+import time
+import asyncio
+
+import pytest
+
+import render
+from render import RenderService, RenderBusyError
+
+
+def slow_render(content, options):
+    time.sleep(0.6)
+    return f'<p>{content}</p>'
+
+
+@pytest.mark.asyncio
+async def test_timed_out_render_keeps_its_slot(monkeypatch):
+    monkeypatch.setattr(render, '_render', slow_render)
+    service = RenderService(workers=1, max_pending=2, timeout=0.2, inline_below=0)
+    service.start()
+    try:
+        with pytest.raises(RenderBusyError):
+            await service.markdown2html('first')
+        # 子进程仍在渲染，位置没有释放
+        assert service.pending == 1
+        # 只有一个渲染进程，在等待位置时超时
+        with pytest.raises(RenderBusyError):
+            await service.markdown2html('second')
+        assert service.pending == 1
+        await asyncio.sleep(0.8)
+        assert service.pending == 0
+        # 超时后才完成的结果仍然写入缓存
+        assert await service.markdown2html('first') == '<p>first</p>'
+    finally:
+        service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pending_includes_timed_out_renders(monkeypatch):
+    monkeypatch.setattr(render, '_render', slow_render)
+    service = RenderService(workers=1, max_pending=1, timeout=0.2, inline_below=0)
+    service.start()
+    try:
+        with pytest.raises(RenderBusyError):
+            await service.markdown2html('third')
+        with pytest.raises(RenderBusyError, match='Too many pending'):
+            await service.markdown2html('fourth')
+        await asyncio.sleep(0.8)
+    finally:
+        service.shutdown()
+
+
+def test_html_cache_counts_utf8_bytes():
+    html = '<p>' + '中文' * 10000 + '</p>'
+    render._html_cache.set('utf8', html)
+    try:
+        assert render._html_cache.bytes >= len(html.encode('utf-8'))
+    finally:
+        render._html_cache.delete('utf8')